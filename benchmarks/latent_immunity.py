@@ -0,0 +1,89 @@
+"""Benchmark gradient evaluations of the hierarchical latent immunity model.
+
+Times the gradient of the model's log density, which dominates the cost of
+each NUTS step, on synthetic counts with the given numbers of time points,
+variants, and groups.
+
+    python benchmarks/latent_immunity.py --groups 10 50 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+
+def simulate_counts(n_time, n_variants, n_groups, seed=0):
+    """Simulate sequence counts with shape (time, variants, groups) where
+    most groups have no sequences at most time points.
+    """
+    rng = np.random.default_rng(seed)
+    N = rng.poisson(5.0, size=(n_time, n_groups)) * (rng.random((n_time, n_groups)) < 0.3)
+    freq = rng.dirichlet(np.ones(n_variants), size=(n_time, n_groups))
+    seq_counts = np.stack(
+        [
+            [rng.multinomial(N[t, g], freq[t, g]) for g in range(n_groups)]
+            for t in range(n_time)
+        ]
+    ).swapaxes(1, 2).astype(float)
+    return seq_counts, seq_counts.sum(axis=1)
+
+
+def benchmark_gradient(n_time, n_variants, n_groups, dim=4, k=4, order=6, repeats=20):
+    """Return seconds to compile and seconds per evaluation of the gradient of
+    the model log density.
+    """
+    import evofr as ef
+    import jax
+    from numpyro import handlers
+    from numpyro.infer.util import log_density
+
+    from latent_immunity_relative_fitness import LatentSplineRW, RelativeFitnessDR
+
+    seq_counts, N = simulate_counts(n_time, n_variants, n_groups)
+    model = RelativeFitnessDR(
+        dim=dim, phi_model=LatentSplineRW(ef.Spline(order=order, k=k)), tau=1.0, hier=True
+    )
+    data = {"seq_counts": seq_counts, "N": N}
+    model.augment_data(data)
+
+    trace = handlers.trace(handlers.seed(model.model_fn, 0)).get_trace(**data)
+    params = {
+        name: site["value"]
+        for name, site in trace.items()
+        if site["type"] == "sample" and not site["is_observed"]
+    }
+
+    grad = jax.jit(
+        jax.grad(lambda p: log_density(model.model_fn, (), data, p)[0])
+    )
+
+    start = time.perf_counter()
+    jax.block_until_ready(grad(params))
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        jax.block_until_ready(grad(params))
+    return compile_time, (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark gradient evaluations of the hierarchical latent immunity model."
+    )
+    parser.add_argument("--time", type=int, default=100, help="Number of time points.")
+    parser.add_argument("--variants", type=int, default=20, help="Number of variants.")
+    parser.add_argument("--groups", type=int, nargs="+", default=[10, 50, 200], help="Numbers of groups to benchmark.")
+    parser.add_argument("--repeats", type=int, default=20, help="Number of gradient evaluations to average over.")
+    args = parser.parse_args()
+
+    print("groups\tcompile_s\tgradient_ms")
+    for n_groups in args.groups:
+        compile_time, gradient_time = benchmark_gradient(
+            args.time, args.variants, n_groups, repeats=args.repeats
+        )
+        print(f"{n_groups}\t{compile_time:.2f}\t{gradient_time * 1000:.2f}")
@@ -0,0 +1,382 @@
+"""Benchmark each stage of the forecasting pipeline on synthetic data.
+
+Generates synthetic metadata and Nextclade annotations at the requested scale
+(see `synthetic_data.py`), then runs the workflow's scripts with the same
+arguments as the Snakefile from haplotype assignment through model fitting,
+export, and parsing of the exported JSON. Reports the wall time, throughput in
+input records per second, and peak memory of each stage and the stage timings
+that `run-model.py` records for model fitting. Everything runs offline.
+
+When a baseline exists for the same scale, reports the change in wall time of
+each stage relative to the baseline and exits with an error if any stage slowed
+down by more than the given tolerance. Baselines depend on the machine, so they
+are only written when requested.
+
+    python benchmarks/pipeline.py --sequences 100000 --locations 50 --haplotypes 20 --weeks 26
+    python benchmarks/pipeline.py --stages collapse_haplotype_counts prepare_data run_model parse_json
+    python benchmarks/pipeline.py --update-baseline
+"""
+import argparse
+from collections import Counter
+import csv
+from datetime import date, timedelta
+import json
+import os
+import subprocess
+import sys
+import time
+
+import yaml
+
+ROOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SCRIPTS_DIRECTORY = os.path.join(ROOT_DIRECTORY, "scripts")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+DATA_NAME = "initial_MLR"
+
+sys.path.insert(0, SCRIPTS_DIRECTORY)
+from stage_timer import maxrss_to_mb
+
+
+def pipeline_stages(data_directory, work_directory, model_config, min_date, max_date, location_min_seq, clade_min_seq):
+    """Return the stages of the pipeline in the order they run.
+
+    Each stage has a name, the command to run, the input file whose records
+    the stage processes, and, for stages that can run without their preceding
+    stage, the synthetic file to use as input instead.
+    """
+    def script(name):
+        return os.path.join(SCRIPTS_DIRECTORY, name)
+
+    def work(name):
+        return os.path.join(work_directory, name)
+
+    model_directory = work("mlr")
+    return [
+        {
+            "name": "assign_haplotypes",
+            "input": os.path.join(data_directory, "metadata_with_nextclade.tsv"),
+            "command": lambda input: [
+                sys.executable, script("assign_haplotypes.py"),
+                "--substitutions", input,
+                "--haplotypes", os.path.join(data_directory, "haplotype_definitions.tsv"),
+                "--clade-column", "clade",
+                "--haplotype-column-name", "emerging_haplotype",
+                "--default-haplotype", "other",
+                "--output-table", work("metadata_with_nextclade_with_emerging_haplotypes.tsv"),
+            ],
+        },
+        {
+            "name": "assign_aa_haplotypes",
+            "input": work("metadata_with_nextclade_with_emerging_haplotypes.tsv"),
+            "synthetic_input": os.path.join(data_directory, "metadata_with_nextclade_with_emerging_haplotypes.tsv"),
+            "command": lambda input: [
+                sys.executable, script("assign_aa_haplotypes.py"),
+                "--nextclade", input,
+                "--genes", "HA1",
+                "--strip-genes",
+                "--clade-column", "clade",
+                "--mutations-column", "founderMuts['clade'].aaSubstitutions",
+                "--attribute-name", "aa_haplotype",
+                "--output", work("metadata_with_nextclade_with_aa_haplotypes.tsv"),
+            ],
+        },
+        {
+            "name": "summarize_counts",
+            "input": work("metadata_with_nextclade_with_aa_haplotypes.tsv"),
+            "synthetic_input": os.path.join(data_directory, "metadata_with_nextclade_with_emerging_haplotypes.tsv"),
+            "command": lambda input: [
+                sys.executable, script("summarize-clade-sequence-counts"),
+                "--metadata", input,
+                "--id-column", "strain",
+                "--date-column", "date",
+                "--location-column", "country",
+                "--clade-column", "emerging_haplotype",
+                "--output", work("seq_counts.tsv"),
+            ],
+        },
+        {
+            "name": "collapse_haplotype_counts",
+            "input": work("seq_counts.tsv"),
+            "synthetic_input": os.path.join(data_directory, "seq_counts.tsv"),
+            "command": lambda input: [
+                sys.executable, script("collapse_haplotype_counts.py"),
+                "--seq-counts", input,
+                "--haplotype-min-seq", str(clade_min_seq),
+                "--output-seq-counts", work("collapsed_seq_counts.tsv"),
+            ],
+        },
+        {
+            "name": "prepare_data",
+            "input": work("collapsed_seq_counts.tsv"),
+            "synthetic_input": os.path.join(data_directory, "seq_counts.tsv"),
+            "command": lambda input: [
+                sys.executable, script("prepare-data.py"),
+                "--seq-counts", input,
+                "--min-date", min_date,
+                "--max-date", max_date,
+                "--location-min-seq", str(location_min_seq),
+                "--clade-min-seq", str(clade_min_seq),
+                "--output-seq-counts", work("prepared_seq_counts.tsv"),
+            ],
+        },
+        {
+            "name": "run_model",
+            "input": work("prepared_seq_counts.tsv"),
+            "synthetic_input": os.path.join(data_directory, "seq_counts.tsv"),
+            "command": lambda input: [
+                sys.executable, "-u", script("run-model.py"),
+                "--seq-path", input,
+                "--config", model_config,
+                "--data-name", DATA_NAME,
+                "--export-path", model_directory,
+                "--max-date", max_date,
+            ],
+            "timings": os.path.join(model_directory, f"{DATA_NAME}_timings.json"),
+        },
+        {
+            "name": "parse_json",
+            "input": os.path.join(model_directory, f"{DATA_NAME}_results.json"),
+            "command": lambda input: [
+                sys.executable, script("parse-json.py"),
+                "--input", input,
+                "--outga", work("ga.tsv"),
+                "--outfreq", work("freq.tsv"),
+                "--outraw", work("raw_freq.tsv"),
+                "--outfreqforecast", work("freq_forecast.tsv"),
+                "--model", "MLR",
+            ],
+        },
+    ]
+
+
+def most_common_clade(seq_counts_path):
+    """Return the clade with the most sequences in the given sequence counts.
+    """
+    sequences_per_clade = Counter()
+    with open(seq_counts_path, newline="") as fh:
+        for record in csv.DictReader(fh, delimiter="\t"):
+            sequences_per_clade[record["clade"]] += int(record["sequences"])
+
+    return sequences_per_clade.most_common(1)[0][0]
+
+
+def count_records(path):
+    """Return the number of records in the given file, counting data rows of
+    tables and entries of the `data` list of JSON results.
+    """
+    if path.endswith(".json"):
+        with open(path) as fh:
+            return len(json.load(fh).get("data", []))
+
+    with open(path, "rb") as fh:
+        return max(sum(1 for _ in fh) - 1, 0)
+
+
+def run_stage(command, log_path):
+    """Run the given command with its output written to the given log and
+    return its wall time in seconds, peak resident memory in MB, and return
+    code.
+    """
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT_DIRECTORY)
+
+        # Wait for this process specifically to get its own resource usage
+        # instead of the maximum over all child processes. Linux counts the
+        # memory of this process at the time of the fork towards the peak
+        # memory of the child, so this process avoids importing large
+        # libraries and generates synthetic data in a separate process.
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+
+    return wall_time, maxrss_to_mb(usage.ru_maxrss), os.waitstatus_to_exitcode(status)
+
+
+def write_model_config(path, pivot, forecast_L, inference):
+    """Write a model config based on the H3N2 config with the given pivot,
+    forecast length, and inference settings.
+    """
+    with open(os.path.join(ROOT_DIRECTORY, "config", "mlr", "h3n2.yaml")) as fh:
+        config = yaml.safe_load(fh)
+
+    config["model"]["pivot"] = pivot
+    config["model"]["forecast_L"] = forecast_L
+    config["inference"].update(inference)
+
+    with open(path, "w") as fh:
+        yaml.safe_dump(config, fh, sort_keys=False)
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Add the baseline wall time and relative change to each stage result and
+    return the names of stages that slowed down by more than the tolerance.
+    """
+    baseline_stages = {stage["stage"]: stage for stage in baseline["stages"]}
+    regressions = []
+    for result in results:
+        baseline_stage = baseline_stages.get(result["stage"])
+        if baseline_stage is None or result["return_code"] != 0:
+            continue
+
+        result["baseline_wall_time_s"] = baseline_stage["wall_time_s"]
+        result["change"] = round(result["wall_time_s"] / baseline_stage["wall_time_s"] - 1, 4)
+        if result["change"] > tolerance:
+            regressions.append(result["stage"])
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the forecasting pipeline on synthetic data.")
+    parser.add_argument("--sequences", type=int, default=100000, help="Number of sequences.")
+    parser.add_argument("--locations", type=int, default=50, help="Number of countries.")
+    parser.add_argument("--haplotypes", type=int, default=20, help="Number of emerging haplotypes.")
+    parser.add_argument("--weeks", type=int, default=26, help="Number of weeks of sequences.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data.")
+    parser.add_argument("--stages", nargs="+", help="Names of stages to run. Stages without their preceding stage use synthetic inputs. Defaults to all stages.")
+    parser.add_argument("--location-min-seq", type=int, default=100, help="Minimum sequences per location to include in the model.")
+    parser.add_argument("--clade-min-seq", type=int, default=30, help="Minimum sequences per haplotype to model it separately.")
+    parser.add_argument("--forecast-L", type=int, default=4, help="Number of time points to forecast.")
+    parser.add_argument("--inference-method", default="NUTS", help="Inference method for the model.")
+    parser.add_argument("--num-warmup", type=int, default=100, help="Number of NUTS warmup steps.")
+    parser.add_argument("--num-samples", type=int, default=100, help="Number of NUTS samples.")
+    parser.add_argument("--iters", type=int, default=2000, help="Number of SVI iterations for MAP and its NUTS initialization.")
+    parser.add_argument("--work-directory", default=os.path.join(ROOT_DIRECTORY, "benchmarks", "work"), help="Directory for synthetic inputs, stage outputs, and logs.")
+    parser.add_argument("--output", help="JSON file to write the benchmark results to.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON file of baseline results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Largest relative increase in wall time of a stage over its baseline that is not reported as a regression.")
+    parser.add_argument("--update-baseline", action="store_true", help="Save these results as the baseline instead of comparing against it.")
+    args = parser.parse_args()
+
+    parameters = {
+        "sequences": args.sequences,
+        "locations": args.locations,
+        "haplotypes": args.haplotypes,
+        "weeks": args.weeks,
+        "seed": args.seed,
+        "forecast_L": args.forecast_L,
+        "inference_method": args.inference_method,
+        "num_warmup": args.num_warmup,
+        "num_samples": args.num_samples,
+        "iters": args.iters,
+    }
+
+    # Generate synthetic inputs and the model config.
+    max_date = "2026-10-01"
+    min_date = (date.fromisoformat(max_date) - timedelta(weeks=args.weeks)).isoformat()
+    data_directory = os.path.join(args.work_directory, "data")
+    log_directory = os.path.join(args.work_directory, "logs")
+    os.makedirs(log_directory, exist_ok=True)
+
+    subprocess.run(
+        [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_data.py"),
+            "--sequences", str(args.sequences),
+            "--locations", str(args.locations),
+            "--haplotypes", str(args.haplotypes),
+            "--weeks", str(args.weeks),
+            "--max-date", max_date,
+            "--seed", str(args.seed),
+            "--output-directory", data_directory,
+        ],
+        check=True,
+        stdout=sys.stderr,
+    )
+    pivot = most_common_clade(os.path.join(data_directory, "seq_counts.tsv"))
+    model_config = os.path.join(args.work_directory, "model_config.yaml")
+    write_model_config(
+        model_config,
+        pivot,
+        args.forecast_L,
+        {
+            "method": args.inference_method,
+            "num_warmup": args.num_warmup,
+            "num_samples": args.num_samples,
+            "iters": args.iters,
+        },
+    )
+
+    stages = pipeline_stages(
+        data_directory,
+        args.work_directory,
+        model_config,
+        min_date,
+        max_date,
+        args.location_min_seq,
+        args.clade_min_seq,
+    )
+    stage_names = [stage["name"] for stage in stages]
+    selected_stages = args.stages or stage_names
+    for name in selected_stages:
+        if name not in stage_names:
+            parser.error(f"Unknown stage '{name}'. Choose from: {', '.join(stage_names)}")
+
+    # Run each stage, stopping at the first failure since later stages need
+    # its output.
+    results = []
+    previous_stage_ran = False
+    for stage in stages:
+        if stage["name"] not in selected_stages:
+            previous_stage_ran = False
+            continue
+
+        input_path = stage["input"]
+        if not previous_stage_ran and "synthetic_input" in stage:
+            input_path = stage["synthetic_input"]
+
+        records = count_records(input_path) if os.path.exists(input_path) else 0
+        log_path = os.path.join(log_directory, f"{stage['name']}.log")
+        print(f"Running {stage['name']} on {records} records", file=sys.stderr)
+        wall_time, peak_rss, return_code = run_stage(stage["command"](input_path), log_path)
+
+        result = {
+            "stage": stage["name"],
+            "records": records,
+            "wall_time_s": round(wall_time, 4),
+            "records_per_s": round(records / wall_time, 2),
+            "peak_rss_mb": round(peak_rss, 1),
+            "return_code": return_code,
+        }
+        if return_code == 0 and "timings" in stage and os.path.exists(stage["timings"]):
+            with open(stage["timings"]) as fh:
+                result["substages"] = json.load(fh)["stages"]
+
+        results.append(result)
+        previous_stage_ran = return_code == 0
+        if return_code != 0:
+            print(f"ERROR: {stage['name']} failed with return code {return_code}. See {log_path}", file=sys.stderr)
+            break
+
+    # Compare to the baseline for the same scale or save these results as the
+    # new baseline.
+    regressions = []
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as fh:
+            json.dump({"parameters": parameters, "stages": results}, fh, indent=2)
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+        if baseline["parameters"] == parameters:
+            regressions = compare_to_baseline(results, baseline, args.tolerance)
+        else:
+            print(f"WARNING: Skipping comparison to {args.baseline} which was run with different parameters.", file=sys.stderr)
+
+    print("stage\trecords\twall_time_s\trecords_per_s\tpeak_rss_mb\tbaseline_wall_time_s\tchange")
+    for result in results:
+        change = f"{result['change']:+.1%}" if "change" in result else ""
+        print(f"{result['stage']}\t{result['records']}\t{result['wall_time_s']:.2f}\t{result['records_per_s']:.1f}\t{result['peak_rss_mb']:.1f}\t{result.get('baseline_wall_time_s', '')}\t{change}")
+        for substage in result.get("substages", []):
+            print(f"  {substage['stage']}\t\t{substage['wall_time_s']:.2f}\t\t{substage['peak_rss_mb']:.1f}\t\t")
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"parameters": parameters, "stages": results}, fh, indent=2)
+
+    failed = any(result["return_code"] != 0 for result in results)
+    if regressions:
+        print(f"ERROR: Stages slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+
+    sys.exit(1 if failed or regressions else 0)
@@ -0,0 +1,45 @@
+"""Benchmark startup time of the pipeline scripts.
+
+Times light invocations of each script that do not need to fit models or build
+plots (printing the help message by default) in fresh Python processes and
+reports the median wall time.
+
+    python benchmarks/startup.py --repeats 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+DEFAULT_SCRIPTS = ["run-model.py", "plot-ga.py", "plot-freq.py", "prepare-data.py"]
+
+
+def time_invocation(command, repeats):
+    """Return wall times in seconds to run the given command the given number
+    of times and the return code of the last run.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times, process.returncode
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark startup time of the pipeline scripts.")
+    parser.add_argument("--scripts", nargs="+", default=DEFAULT_SCRIPTS, help="Names of scripts in the scripts directory to time.")
+    parser.add_argument("--args", nargs="*", default=["--help"], help="Arguments to pass to each script.")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of times to run each script.")
+    args = parser.parse_args()
+
+    print("script\tmedian_s\tmin_s\treturn_code")
+    for script in args.scripts:
+        times, return_code = time_invocation(
+            [sys.executable, os.path.join(SCRIPTS_DIRECTORY, script)] + args.args,
+            args.repeats,
+        )
+        print(f"{script}\t{statistics.median(times):.3f}\t{min(times):.3f}\t{return_code}")
@@ -0,0 +1,200 @@
+"""Generate synthetic inputs for benchmarking the forecasting pipeline.
+
+Writes GISAID-like metadata, Nextclade annotations, their join (as produced by
+the `metadata_with_nextclade` rule), haplotype definitions, and the emerging
+haplotype annotations and sequence counts per location, haplotype, and date
+that the workflow derives from these inputs, so benchmarks can start from any
+stage. Haplotype frequencies follow logistic growth with a different growth
+advantage per haplotype, so models fit to the counts have a signal to find.
+
+    python benchmarks/synthetic_data.py --sequences 100000 --locations 50 --haplotypes 20 --weeks 26 --output-directory benchmarks/data
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+CLADE_COLUMN = "clade"
+NUCLEOTIDE_COLUMN = f"founderMuts['{CLADE_COLUMN}'].substitutions"
+MUTATIONS_COLUMN = f"founderMuts['{CLADE_COLUMN}'].aaSubstitutions"
+DEFAULT_HAPLOTYPE = "other"
+AMINO_ACIDS = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+
+
+def haplotype_definitions(n_haplotypes):
+    """Return haplotype names with their clade and defining HA1 substitution.
+
+    Every other haplotype derives from the same clade, so clades contain
+    several haplotypes like the real definitions do.
+
+    >>> haplotype_definitions(3)
+    [('J.1:101K', 'J.1', 'A', 101, 'K'), ('J.1:102K', 'J.1', 'A', 102, 'K'), ('J.2:103K', 'J.2', 'A', 103, 'K')]
+    """
+    definitions = []
+    for index in range(n_haplotypes):
+        clade = f"J.{index // 2 + 1}"
+        site = 101 + index
+        definitions.append((f"{clade}:{site}K", clade, "A", site, "K"))
+    return definitions
+
+
+def simulate_frequencies(n_weeks, n_locations, n_variants, rng):
+    """Return variant frequencies with shape (weeks, locations, variants) from
+    logistic growth with shared growth advantages and per-location intercepts.
+    """
+    growth_advantage = rng.normal(0.0, 0.15, size=n_variants)
+    intercepts = rng.normal(0.0, 1.0, size=(n_locations, n_variants))
+    weeks = np.arange(n_weeks)[:, None, None]
+    logits = intercepts[None, :, :] + growth_advantage[None, None, :] * (weeks - n_weeks / 2)
+    logits -= logits.max(axis=-1, keepdims=True)
+    frequencies = np.exp(logits)
+    return frequencies / frequencies.sum(axis=-1, keepdims=True)
+
+
+def generate(n_sequences, n_locations, n_haplotypes, n_weeks, max_date="2026-10-01", other_fraction=0.1, seed=0):
+    """Generate synthetic metadata and Nextclade annotations.
+
+    Returns a data frame with one record per sequence including the columns of
+    both tables, the haplotype definitions as a data frame in the format read
+    by `assign_haplotypes.py`, and the name of the most common haplotype.
+    """
+    rng = np.random.default_rng(seed)
+    definitions = haplotype_definitions(n_haplotypes)
+    clades = sorted({clade for _, clade, _, _, _ in definitions})
+
+    # Sample each sequence's week and location, with sequencing effort that
+    # differs between locations, then its haplotype given the week and location.
+    location_weights = rng.dirichlet(np.full(n_locations, 0.5))
+    weeks = rng.integers(0, n_weeks, size=n_sequences)
+    locations = rng.choice(n_locations, size=n_sequences, p=location_weights)
+
+    frequencies = simulate_frequencies(n_weeks, n_locations, n_haplotypes, rng)
+    cumulative = frequencies[weeks, locations].cumsum(axis=-1)
+    haplotypes = (rng.random(n_sequences)[:, None] > cumulative).sum(axis=-1)
+    haplotypes = np.minimum(haplotypes, n_haplotypes - 1)
+
+    # Some sequences have no defining substitution and keep the default
+    # haplotype.
+    is_other = rng.random(n_sequences) < other_fraction
+
+    days_before_max_date = (n_weeks - 1 - weeks) * 7 + rng.integers(0, 7, size=n_sequences)
+    dates = pd.Timestamp(max_date) - pd.to_timedelta(days_before_max_date, unit="D")
+
+    names = np.array([name for name, _, _, _, _ in definitions], dtype=object)
+    clade_names = np.array([clade for _, clade, _, _, _ in definitions], dtype=object)
+    defining_substitutions = np.array(
+        [f"HA1:{ref}{site}{alt}" for _, _, ref, site, alt in definitions],
+        dtype=object,
+    )
+
+    # Add a private substitution outside of the defining sites to about half of
+    # the sequences, so amino acid haplotypes vary within each emerging haplotype.
+    private_sites = rng.integers(200, 220, size=n_sequences)
+    private_alleles = AMINO_ACIDS[rng.integers(0, len(AMINO_ACIDS), size=n_sequences)]
+    private_substitutions = np.where(
+        rng.random(n_sequences) < 0.5,
+        [f"HA1:S{site}{allele}" for site, allele in zip(private_sites, private_alleles)],
+        "",
+    )
+    substitutions = np.where(is_other, "", defining_substitutions[haplotypes])
+    aa_substitutions = [
+        ",".join(substitution for substitution in pair if substitution)
+        for pair in zip(substitutions, private_substitutions)
+    ]
+
+    records = pd.DataFrame({
+        "strain": [f"A/synthetic/{index}/2026" for index in range(n_sequences)],
+        "date": dates.strftime("%Y-%m-%d"),
+        "region": [f"Region {location % 6 + 1}" for location in locations],
+        "country": [f"Country {location + 1}" for location in locations],
+        CLADE_COLUMN: np.where(is_other, rng.choice(clades, size=n_sequences), clade_names[haplotypes]),
+        "qc.overallStatus": "good",
+        "substitutions": "",
+        "aaSubstitutions": aa_substitutions,
+        NUCLEOTIDE_COLUMN: "",
+        MUTATIONS_COLUMN: aa_substitutions,
+        "emerging_haplotype": np.where(is_other, DEFAULT_HAPLOTYPE, names[haplotypes]),
+    })
+
+    definitions = pd.DataFrame(
+        [
+            row
+            for name, clade, _, site, alt in definitions
+            for row in ((name, "clade", clade, ""), (name, "HA1", site, alt))
+        ],
+        columns=["haplotype", "gene", "site", "alt"],
+    )
+
+    pivot = records["emerging_haplotype"].value_counts().index[0]
+    return records, definitions, pivot
+
+
+def count_sequences(records, location_column="country", clade_column="emerging_haplotype"):
+    """Count sequences per location, clade, and date in the format written by
+    `summarize-clade-sequence-counts`.
+    """
+    return records.groupby(
+        [location_column, clade_column, "date"],
+        as_index=False,
+    ).size().rename(
+        columns={location_column: "location", clade_column: "clade", "size": "sequences"},
+    ).sort_values(["location", "clade", "date"])
+
+
+def write_inputs(directory, n_sequences, n_locations, n_haplotypes, n_weeks, max_date="2026-10-01", seed=0):
+    """Write synthetic pipeline inputs to the given directory and return the
+    name of the most common haplotype to use as the model pivot.
+    """
+    os.makedirs(directory, exist_ok=True)
+    records, definitions, pivot = generate(
+        n_sequences, n_locations, n_haplotypes, n_weeks, max_date=max_date, seed=seed
+    )
+
+    metadata_columns = ["strain", "date", "region", "country"]
+    nextclade_columns = [
+        CLADE_COLUMN,
+        "qc.overallStatus",
+        "substitutions",
+        "aaSubstitutions",
+        NUCLEOTIDE_COLUMN,
+        MUTATIONS_COLUMN,
+    ]
+
+    records[metadata_columns].to_csv(os.path.join(directory, "metadata.tsv"), sep="\t", index=False)
+    records[["strain"] + nextclade_columns].rename(columns={"strain": "seqName"}).to_csv(
+        os.path.join(directory, "nextclade.tsv"), sep="\t", index=False
+    )
+    records[metadata_columns + nextclade_columns].to_csv(
+        os.path.join(directory, "metadata_with_nextclade.tsv"), sep="\t", index=False
+    )
+    records[metadata_columns + nextclade_columns + ["emerging_haplotype"]].to_csv(
+        os.path.join(directory, "metadata_with_nextclade_with_emerging_haplotypes.tsv"), sep="\t", index=False
+    )
+    definitions.to_csv(os.path.join(directory, "haplotype_definitions.tsv"), sep="\t", index=False)
+    count_sequences(records).to_csv(os.path.join(directory, "seq_counts.tsv"), sep="\t", index=False)
+
+    return pivot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic inputs for benchmarking the forecasting pipeline.")
+    parser.add_argument("--sequences", type=int, default=100000, help="Number of sequences.")
+    parser.add_argument("--locations", type=int, default=50, help="Number of countries.")
+    parser.add_argument("--haplotypes", type=int, default=20, help="Number of emerging haplotypes.")
+    parser.add_argument("--weeks", type=int, default=26, help="Number of weeks of sequences.")
+    parser.add_argument("--max-date", default="2026-10-01", help="Date of the latest sequences.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--output-directory", required=True, help="Directory to write the synthetic inputs to.")
+    args = parser.parse_args()
+
+    pivot = write_inputs(
+        args.output_directory,
+        args.sequences,
+        args.locations,
+        args.haplotypes,
+        args.weeks,
+        max_date=args.max_date,
+        seed=args.seed,
+    )
+    print(f"Wrote synthetic inputs to {args.output_directory} with most common haplotype {pivot}")
@@ -2,9 +2,11 @@
 import argparse
 import json
 import sys
+from profiling import profile_from_environment
 
 
 if __name__ == '__main__':
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--model", required=True, help="JSON file of model to add colors to")
     parser.add_argument("--auspice-config", required=True, help="Auspice config JSON with a color scale to use to color variants in the given model")
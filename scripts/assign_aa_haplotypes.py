@@ -4,6 +4,7 @@ substitutions relative to the clade.
 import argparse
 import json
 import pandas as pd
+from profiling import profile_from_environment
 
 
 def create_haplotype_for_record(record, clade_column, mutations_column, genes=None, strip_genes=False, sites_by_gene=None):
@@ -50,6 +51,7 @@ def create_haplotype_for_record(record, clade_column, mutations_column, genes=No
 
 
 if __name__ == '__main__':
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
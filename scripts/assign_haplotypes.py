@@ -2,12 +2,16 @@
 import argparse
 from collections import defaultdict
 from functools import partial
+import hashlib
+import json
+import os
 import sys
 
 from augur.io import read_metadata
 from augur.io.file import PANDAS_READ_CSV_OPTIONS
 from augur.utils import write_json
 import pandas as pd
+from profiling import profile_from_environment
 
 
 def nucleotide_substitutions_match(record_substitutions, required_substitutions):
@@ -125,53 +129,25 @@ def assign_haplotype(record, haplotype_definitions, clade_column, default_haplot
     return assigned_name
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("--substitutions", required=True, help="TSV file with clades and substitutions from Nextclade")
-    parser.add_argument("--haplotypes", required=True, help="""
-    TSV file of haplotype definitions in 'augur clades' format except with the 'clade' column name replaced with 'haplotype'.
-    Haplotypes will be assigned to each input record in the order they appear in this file.
-    Records matching multiple haplotypes will receive the haplotype that appears latest in the file.
-    Define haplotypes that derive from existing clades by specifying 'clade' in the 'gene' field and the clade name in the 'site' field.
-    All defining substitutions for derived haplotypes will be checked against the column specified with the `--clade-column` argument and corresponding 'founderMuts' column of the Nextclade annotations.
-    For example, if a haplotype is defined relative the 'subclade' column, its amino acid substitutions will be checked against the "founderMuts['subclade'].aaSubstitutions" column.
-    """)
-    parser.add_argument("--metadata-id-columns", default=["strain", "seqName"], help="names of possible columns in the substitutions table to use as the record id")
-    parser.add_argument("--clade-column", default="subclade", help="name of the column in the substitutions table corresponding to clades used in the haplotype definitions")
-    parser.add_argument("--haplotype-column-name", default="haplotype", help="name of the column or attribute to store the annotated haplotype in the output")
-    parser.add_argument("--default-haplotype", default="unassigned", help="value to assign to records without any match to the given haplotypes")
-    parser.add_argument("--use-clade-as-default-haplotype", action="store_true", help="use the existing clade annotation for records without assigned haplotypes instead of using the hardcoded default value")
-    parser.add_argument("--output-table", required=True, help="TSV file of substitutions annotated by haplotype")
-    parser.add_argument("--output-node-data", help="JSON in Nextstrain's node data format with haplotypes annotated per record id")
-
-    args = parser.parse_args()
-
-    substitutions = read_metadata(
-        args.substitutions,
-        id_columns=args.metadata_id_columns,
-    )
-
-    if args.haplotype_column_name in substitutions.columns:
-        print(
-            f"ERROR: The requested column name for haplotype annotations, '{args.haplotype_column_name}', already exists in the substitutions table.",
-            file=sys.stderr,
-        )
-        sys.exit(1)
+def read_haplotype_definitions(path):
+    """Read haplotype definitions from the given TSV or CSV file and return a
+    dictionary of definitions by haplotype name in the order they appear in the
+    file. Each definition may have a clade, a list of nucleotide substitutions
+    ('nuc'), and a list of gene and amino acid substitution pairs ('aa').
 
+    Raises a ValueError when the file has no 'haplotype' column or a haplotype
+    has more than one clade.
+    """
     haplotype_definitions = pd.read_csv(
-        args.haplotypes,
-        sep='\t' if args.haplotypes.endswith('.tsv') else ',',
+        path,
+        sep='\t' if path.endswith('.tsv') else ',',
         comment='#',
         na_filter=False,
         **PANDAS_READ_CSV_OPTIONS,
     )
 
     if "haplotype" not in haplotype_definitions.columns:
-        print(
-            f"ERROR: The column 'haplotype' is missing from the given haplotype definitions file, '{args.haplotypes}'.",
-            file=sys.stderr,
-        )
-        sys.exit(1)
+        raise ValueError(f"The column 'haplotype' is missing from the given haplotype definitions file, '{path}'.")
 
     haplotype_definition_by_name = {}
     for haplotype_name, haplotype_definition in haplotype_definitions.groupby("haplotype", sort=False):
@@ -181,11 +157,7 @@ if __name__ == '__main__':
                 # When a haplotype has a clade definition, all substitutions in
                 # the definition will be relative to that clade.
                 if "clade" in definition:
-                    print(
-                        f"ERROR: The haplotype '{haplotype_name}' has multiple clades in its definition which is not possible.",
-                        file=sys.stderr,
-                    )
-                    sys.exit(1)
+                    raise ValueError(f"The haplotype '{haplotype_name}' has multiple clades in its definition which is not possible.")
 
                 definition["clade"] = record["site"]
             elif record["gene"] == "nuc":
@@ -212,6 +184,107 @@ if __name__ == '__main__':
 
         haplotype_definition_by_name[haplotype_name] = definition
 
+    return haplotype_definition_by_name
+
+
+def assignment_cache_keys(substitutions, clade_column, haplotypes_path, settings):
+    """Return a key for each record that changes whenever the record's clade or
+    substitutions, the haplotype definitions, or the given assignment settings
+    change.
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    with open(haplotypes_path, "rb") as fh:
+        digest.update(fh.read())
+
+    # Only the columns that assign_haplotype reads can change a record's
+    # haplotype.
+    columns = [
+        column
+        for column in (
+            clade_column,
+            f"founderMuts['{clade_column}'].substitutions",
+            f"founderMuts['{clade_column}'].aaSubstitutions",
+            "substitutions",
+            "aaSubstitutions",
+        )
+        if column in substitutions.columns
+    ]
+    records = substitutions[columns].astype(str).assign(definitions_hash=digest.hexdigest())
+    return pd.util.hash_pandas_object(records, index=False).astype(str).values
+
+
+def read_assignment_cache(path):
+    """Read cached haplotypes and their keys indexed by record id from the
+    given TSV or return None if there is no cache yet.
+    """
+    if not os.path.exists(path):
+        return None
+
+    return pd.read_csv(
+        path,
+        sep="\t",
+        dtype=str,
+        na_filter=False,
+        index_col="id",
+    )
+
+
+def write_assignment_cache(path, ids, keys, haplotypes):
+    """Write the haplotype and key of each record to the given TSV.
+    """
+    pd.DataFrame({
+        "id": ids,
+        "key": keys,
+        "haplotype": haplotypes,
+    }).to_csv(f"{path}.tmp", sep="\t", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+if __name__ == '__main__':
+    profile_from_environment(__file__)
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--substitutions", required=True, help="TSV file with clades and substitutions from Nextclade")
+    parser.add_argument("--haplotypes", required=True, help="""
+    TSV file of haplotype definitions in 'augur clades' format except with the 'clade' column name replaced with 'haplotype'.
+    Haplotypes will be assigned to each input record in the order they appear in this file.
+    Records matching multiple haplotypes will receive the haplotype that appears latest in the file.
+    Define haplotypes that derive from existing clades by specifying 'clade' in the 'gene' field and the clade name in the 'site' field.
+    All defining substitutions for derived haplotypes will be checked against the column specified with the `--clade-column` argument and corresponding 'founderMuts' column of the Nextclade annotations.
+    For example, if a haplotype is defined relative the 'subclade' column, its amino acid substitutions will be checked against the "founderMuts['subclade'].aaSubstitutions" column.
+    """)
+    parser.add_argument("--metadata-id-columns", default=["strain", "seqName"], help="names of possible columns in the substitutions table to use as the record id")
+    parser.add_argument("--clade-column", default="subclade", help="name of the column in the substitutions table corresponding to clades used in the haplotype definitions")
+    parser.add_argument("--haplotype-column-name", default="haplotype", help="name of the column or attribute to store the annotated haplotype in the output")
+    parser.add_argument("--default-haplotype", default="unassigned", help="value to assign to records without any match to the given haplotypes")
+    parser.add_argument("--use-clade-as-default-haplotype", action="store_true", help="use the existing clade annotation for records without assigned haplotypes instead of using the hardcoded default value")
+    parser.add_argument("--output-table", required=True, help="TSV file of substitutions annotated by haplotype")
+    parser.add_argument("--output-node-data", help="JSON in Nextstrain's node data format with haplotypes annotated per record id")
+    parser.add_argument("--cache", help="""
+    TSV file of haplotypes assigned in previous runs to reuse for records whose clade and substitutions have not changed.
+    The whole cache is ignored when the haplotype definitions or assignment options change.
+    The cache is created if it does not exist and updated with the assignments of this run.
+    """)
+
+    args = parser.parse_args()
+
+    substitutions = read_metadata(
+        args.substitutions,
+        id_columns=args.metadata_id_columns,
+    )
+
+    if args.haplotype_column_name in substitutions.columns:
+        print(
+            f"ERROR: The requested column name for haplotype annotations, '{args.haplotype_column_name}', already exists in the substitutions table.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    try:
+        haplotype_definition_by_name = read_haplotype_definitions(args.haplotypes)
+    except ValueError as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        sys.exit(1)
+
     assign_haplotype_per_record = partial(
         assign_haplotype,
         haplotype_definitions=haplotype_definition_by_name,
@@ -220,11 +293,44 @@ if __name__ == '__main__':
         use_clade_as_default_haplotype=args.use_clade_as_default_haplotype,
     )
 
-    # Assign haplotypes to each row.
-    substitutions[args.haplotype_column_name] = substitutions.apply(
-        assign_haplotype_per_record,
-        axis=1,
-    )
+    if args.cache:
+        # Reuse cached haplotypes of records whose key has not changed and
+        # assign haplotypes to the remaining rows.
+        keys = assignment_cache_keys(
+            substitutions,
+            args.clade_column,
+            args.haplotypes,
+            {
+                "clade_column": args.clade_column,
+                "default_haplotype": args.default_haplotype,
+                "use_clade_as_default_haplotype": args.use_clade_as_default_haplotype,
+            },
+        )
+        haplotypes = pd.Series(args.default_haplotype, index=substitutions.index, dtype=object)
+
+        cache = read_assignment_cache(args.cache)
+        if cache is not None:
+            cached = cache.reindex(substitutions.index)
+            is_cached = (cached["key"] == keys).values
+            haplotypes[is_cached] = cached.loc[is_cached, "haplotype"].values
+        else:
+            is_cached = pd.Series(False, index=substitutions.index).values
+
+        print(f"Reusing cached haplotypes for {is_cached.sum()} of {len(substitutions)} records.")
+        if not is_cached.all():
+            haplotypes[~is_cached] = substitutions[~is_cached].apply(
+                assign_haplotype_per_record,
+                axis=1,
+            ).values
+
+        substitutions[args.haplotype_column_name] = haplotypes
+        write_assignment_cache(args.cache, substitutions.index, keys, haplotypes.values)
+    else:
+        # Assign haplotypes to each row.
+        substitutions[args.haplotype_column_name] = substitutions.apply(
+            assign_haplotype_per_record,
+            axis=1,
+        )
 
     substitutions.to_csv(
         args.output_table,
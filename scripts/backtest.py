@@ -0,0 +1,185 @@
+"""Evaluate forecasts of hierarchical models from past forecast origins.
+
+Each forecast origin truncates the same count tensor to the counts available
+on that date, fits the model to the truncated counts, and scores the forecast
+frequencies against the counts observed in each forecast interval after the
+origin. Consecutive origins start from the posterior of the previous origin, so
+later fits only refine an estimate that is already close. Origins can be split
+into segments that each start from scratch, so segments can run concurrently.
+
+Scores are reported per origin, location, and horizon as:
+
+- `log_score`: mean log forecast frequency of the variants of the sequences
+  observed in the forecast interval (higher is better).
+- `mae`: mean absolute error of the forecast frequencies of all variants
+  against the observed frequencies in the forecast interval.
+"""
+import numpy as np
+import pandas as pd
+import numpyro
+from evofr.posterior.posterior_helpers import forecast_dates
+
+from hier_frequencies import HierFrequencies
+from stage_timer import StageTimer
+
+METRICS_COLUMNS = [
+    "origin",
+    "location",
+    "horizon",
+    "forecast_date",
+    "sequences",
+    "log_score",
+    "mae",
+]
+
+
+def split_origins(origins, segment_size=None):
+    """Split sorted origins into segments of the given number of consecutive
+    origins. The first origin of each segment starts from scratch, so the
+    segments can run concurrently without changing their scores. Without a
+    segment size, all origins form one segment.
+
+    >>> split_origins(["2024-01-01", "2024-02-01", "2024-03-01"], 2)
+    [['2024-01-01', '2024-02-01'], ['2024-03-01']]
+    >>> split_origins(["2024-01-01", "2024-02-01"])
+    [['2024-01-01', '2024-02-01']]
+    """
+    origins = [str(origin) for origin in origins]
+    segment_size = segment_size or len(origins)
+    return [origins[start:start + segment_size] for start in range(0, len(origins), segment_size)]
+
+
+def warm_start_values(model, data_dict, samples):
+    """Return the posterior mean of each latent site of the model from the
+    samples of a previous fit where the site has the same shape in the given
+    data, so these values can initialize a fit with `init_to_value`.
+    """
+    model_trace = numpyro.handlers.trace(
+        numpyro.handlers.seed(model.model_fn, 0)
+    ).get_trace(**data_dict)
+
+    values = {}
+    for name, site in model_trace.items():
+        if site["type"] != "sample" or site["is_observed"] or name not in samples:
+            continue
+
+        value = np.asarray(samples[name]).mean(axis=0)
+        if value.shape == np.shape(site["value"]):
+            values[name] = value
+
+    return values
+
+
+def observed_counts(count_tensor, var_names, start, end):
+    """Return counts of the given variants by location on the dates after
+    the start date up to and including the end date.
+    """
+    dates = pd.DatetimeIndex(count_tensor.dates)
+    first, last = dates.searchsorted(start, side="right"), dates.searchsorted(end, side="right")
+    variant_order = [count_tensor.variants.index(name) for name in var_names]
+    return np.nansum(count_tensor.counts[first:last][:, variant_order, :], axis=0)
+
+
+def forecast_metrics(forecast_freq, count_tensor, data, origin):
+    """Score forecast frequencies with shape (samples, horizons, variants,
+    groups) for the given data against the counts observed in each forecast
+    interval. Intervals that end after the last date of the count tensor or
+    locations without sequences in an interval are not scored.
+    """
+    forecast_freq = np.asarray(forecast_freq).mean(axis=0)
+    horizon_dates = [data.dates[-1]] + forecast_dates(data.dates, forecast_freq.shape[0])
+    last_date = count_tensor.dates[-1]
+
+    rows = []
+    for horizon in range(1, len(horizon_dates)):
+        if horizon_dates[horizon] > last_date:
+            break
+
+        counts = observed_counts(count_tensor, data.var_names, horizon_dates[horizon - 1], horizon_dates[horizon])
+        totals = counts.sum(axis=0)
+        for group, location in enumerate(data.names):
+            if totals[group] == 0:
+                continue
+
+            predicted = forecast_freq[horizon - 1, :, group]
+            observed = counts[:, group] / totals[group]
+            log_predicted = np.log(np.maximum(predicted, np.finfo(float).tiny))
+            rows.append({
+                "origin": pd.Timestamp(origin).strftime("%Y-%m-%d"),
+                "location": location,
+                "horizon": horizon,
+                "forecast_date": horizon_dates[horizon].strftime("%Y-%m-%d"),
+                "sequences": int(totals[group]),
+                "log_score": float((counts[:, group] * log_predicted).sum() / totals[group]),
+                "mae": float(np.abs(predicted - observed).mean()),
+            })
+
+    return rows
+
+
+def backtest_origins(count_tensor, origins, model, fit, pivot=None, aggregation_frequency=None, timer=None):
+    """Fit the model to the counts available at each of the given forecast
+    origins in order and score its forecasts.
+
+    Parameters
+    ----------
+    count_tensor:
+        counts by date, variant, and location for all origins and the
+        forecast intervals after them.
+
+    origins:
+        sorted forecast origins as ISO 8601 dates.
+
+    model:
+        hierarchical model with `forecast_L` forecast time points.
+
+    fit:
+        function to fit the model with arguments (model, data, name,
+        init_values) returning a posterior. Initial values are None for the
+        first origin.
+
+    pivot:
+        optional name of variant to place last.
+
+    aggregation_frequency:
+        optional temporal frequency used to aggregate daily counts.
+
+    timer:
+        optional `StageTimer` to time the stages of each origin.
+
+    Returns
+    -------
+    list of dict
+        metrics of each origin, location, and horizon.
+    """
+    timer = timer if timer is not None else StageTimer()
+    rows = []
+    samples = None
+    for origin in origins:
+        name = f"origin-{origin}"
+        with timer.stage("construct_data", model=name):
+            data = HierFrequencies.from_count_tensor(
+                count_tensor.truncate(origin),
+                pivot=pivot,
+                max_date=origin,
+                aggregation_frequency=aggregation_frequency,
+            )
+
+        # Start from the posterior of the previous origin
+        init_values = None
+        if samples is not None:
+            data_dict = data.make_data_dict()
+            model.augment_data(data_dict)
+            init_values = warm_start_values(model, data_dict, samples)
+
+        posterior = fit(model, data, name, init_values)
+        samples = posterior.samples
+
+        with timer.stage("forecast", model=name):
+            model.forecast_frequencies(samples, forecast_L=model.forecast_L)
+            metrics = forecast_metrics(samples["freq_forecast"], count_tensor, data, origin)
+
+        print(f"Scored {len(metrics)} forecasts from origin {origin}")
+        rows.extend(metrics)
+
+    return rows
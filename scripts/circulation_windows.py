@@ -25,8 +25,15 @@ def find_extant_window(data, left_buffer=0, right_buffer=0):
     return np.vstack((first_index, last_index)).T
 
 
-def find_circulating_at_time(data, left_buffer=0, right_buffer=0):
-    # Initialize a list to hold lists of variable indices for each time point
+def find_circulation_mask(data, left_buffer=0, right_buffer=0):
+    """
+    Return a boolean mask with shape (time, variants) that is True where the
+    time point falls within the window each variant circulates in.
+
+    >>> counts = np.array([[1, 0], [2, 0], [1, 3], [0, 1]])[:, :, None]
+    >>> find_circulation_mask(counts).astype(int).tolist()
+    [[1, 0], [1, 0], [1, 1], [0, 1]]
+    """
     T = data.shape[0]
 
     # Find windows
@@ -34,39 +41,41 @@ def find_circulating_at_time(data, left_buffer=0, right_buffer=0):
         data, left_buffer=left_buffer, right_buffer=right_buffer
     )
 
-    # Initialize a mask array
-    mask = np.zeros((T, data.shape[1]), dtype=bool)
-
     # True where the time point falls within window
-    for v, (start, end) in enumerate(windows):
-        mask[start : end + 1, v] = True
+    times = np.arange(T)[:, None]
+    return (times >= windows[None, :, 0]) & (times <= windows[None, :, 1])
+
+
+def find_circulating_at_time(data, left_buffer=0, right_buffer=0):
+    mask = find_circulation_mask(data, left_buffer, right_buffer)
 
     # Convert mask to list of indices for each time point
-    circulating_at_time = [np.where(mask[t])[0].tolist() for t in range(T)]
+    _, variants = np.nonzero(mask)
+    circulating_at_time = [
+        circulating.tolist()
+        for circulating in np.split(variants, np.cumsum(mask.sum(axis=1))[:-1])
+    ]
 
     return circulating_at_time, mask
 
 
-def generate_minimal_windows(circulating_at_time):
-    # Initialize variables
-    minimal_windows = []
-    current_start = 0
-    current_vars = set(circulating_at_time[0])
-
-    # Iterate over each time point after the first
-    for t in range(1, len(circulating_at_time)):
-        new_vars = set(circulating_at_time[t])
+def generate_minimal_windows_from_mask(mask):
+    """
+    Split time into the fewest windows with a constant set of circulating
+    variants from a boolean mask of shape (time, variants).
 
-        # Check if the current set of variables is different from the new set
-        if new_vars != current_vars:
-            # If different, end the current window and start a new one
-            window_idx = np.arange(current_start, t)
-            minimal_windows.append((window_idx, np.array(list(current_vars))))
-            current_start = t
-            current_vars = new_vars
+    >>> mask = np.array([[1, 0], [1, 0], [1, 1], [0, 1]], dtype=bool)
+    >>> [(t.tolist(), v.tolist()) for t, v in generate_minimal_windows_from_mask(mask)]
+    [([0, 1], [0]), ([2], [0, 1]), ([3], [1])]
+    """
+    T = mask.shape[0]
 
-    # Add the last window
-    window_idx = np.arange(current_start, len(circulating_at_time))
-    minimal_windows.append((window_idx, np.array(list(current_vars))))
+    # Windows start wherever the set of circulating variants changes
+    changes = np.flatnonzero(np.any(mask[1:] != mask[:-1], axis=1)) + 1
+    starts = np.concatenate(([0], changes))
+    ends = np.concatenate((changes, [T]))
 
-    return minimal_windows
+    return [
+        (np.arange(start, end), np.flatnonzero(mask[start]))
+        for start, end in zip(starts, ends)
+    ]
@@ -1,6 +1,7 @@
 """Collapse low-count haplotype counts into parent clades."""
 import argparse
 import pandas as pd
+from profiling import profile_from_environment
 
 
 def positive_int(value):
@@ -16,6 +17,7 @@ def positive_int(value):
 
 
 if __name__ == '__main__':
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(
         __doc__,
         formatter_class=argparse.RawTextHelpFormatter
@@ -0,0 +1,211 @@
+"""Store sequence counts as a dense count tensor with labeled axes.
+
+A count tensor bundle is a directory with the counts of each variant per date
+and location in `counts.npy`, a float32 array with shape (dates, variants,
+locations), and the labels of each axis in `axes.json`. Counts on dates without
+any sequences in a location are NaN as for `evofr.VariantFrequencies`. Loading
+a bundle memory-maps the counts, so scripts can use counts prepared by
+`prepare-data.py` without parsing and regrouping the sequence counts table.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+COUNTS_FILENAME = "counts.npy"
+AXES_FILENAME = "axes.json"
+
+
+def counts_to_tensor(
+    raw_seq: pd.DataFrame,
+    group_codes: np.ndarray,
+    n_groups: int,
+    date_to_index: dict,
+    var_names: list,
+) -> np.ndarray:
+    """Scatter sequence counts into a dense array of counts by date, variant,
+    and group in a single pass over the rows of the given dataframe.
+
+    As for `evofr.VariantFrequencies`, counts of variants without sequences
+    on a date with sequences of other variants in the same group are zero,
+    and counts on dates without any sequences in a group are NaN.
+
+    Parameters
+    ----------
+    raw_seq:
+        a dataframe containing sequence counts with columns 'sequences',
+        'variant', and date'.
+
+    group_codes:
+        integer codes of the group of each row in the dataframe.
+
+    n_groups:
+        number of groups.
+
+    date_to_index:
+        dictionary for mapping calender dates to nd.array indices.
+
+    var_names:
+        list of variant names in order of the variant axis.
+
+    Returns
+    -------
+    seq_counts:
+        nd.array of sequence counts with shape (dates, variants, groups).
+    """
+    time_codes = pd.to_datetime(raw_seq["date"]).map(date_to_index)
+    if time_codes.isna().any():
+        raise ValueError("Sequence counts include dates missing from the given date_to_index.")
+    time_codes = time_codes.to_numpy(dtype=int)
+    variant_codes = pd.Categorical(raw_seq["variant"], categories=var_names).codes
+
+    T, V, G = len(date_to_index), len(var_names), n_groups
+    counts = np.bincount(
+        (time_codes * V + variant_codes) * G + group_codes,
+        weights=raw_seq["sequences"].to_numpy(dtype=float),
+        minlength=T * V * G,
+    ).reshape(T, V, G)
+
+    # Dates without any sequences in a group are unobserved
+    observed = np.bincount(time_codes * G + group_codes, minlength=T * G).reshape(T, G) > 0
+    return np.where(observed[:, None, :], counts, np.nan)
+
+
+def is_count_tensor(path):
+    """Return whether the given path is a count tensor bundle.
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, COUNTS_FILENAME))
+
+
+class CountTensor:
+    def __init__(self, counts, dates, variants, locations):
+        """Sequence counts by date, variant, and location.
+
+        Parameters
+        ----------
+        counts:
+            array of sequence counts with shape (dates, variants, locations)
+            with NaN for dates without sequences in a location.
+
+        dates:
+            list of consecutive daily dates as pandas Timestamps.
+
+        variants:
+            sorted list of variant names.
+
+        locations:
+            sorted list of location names.
+
+        Returns
+        -------
+        CountTensor
+        """
+        self.counts = counts
+        self.dates = dates
+        self.variants = variants
+        self.locations = locations
+
+    @classmethod
+    def from_seq_counts(cls, seq_counts: pd.DataFrame, group: str = "location") -> "CountTensor":
+        """Build counts from a dataframe with columns 'date', 'variant',
+        'sequences', and the given group column, with one daily date for each
+        day between the first and last date with sequences.
+        """
+        dates = list(pd.date_range(pd.to_datetime(seq_counts["date"]).min(), pd.to_datetime(seq_counts["date"]).max(), freq="D"))
+        variants = sorted(pd.unique(seq_counts["variant"]))
+        group_codes, locations = pd.factorize(seq_counts[group], sort=True)
+        counts = counts_to_tensor(
+            seq_counts,
+            group_codes,
+            len(locations),
+            {date: index for index, date in enumerate(dates)},
+            variants,
+        )
+        return cls(counts.astype(np.float32), dates, variants, list(locations))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r") -> "CountTensor":
+        """Load a bundle saved by `CountTensor.save`, memory-mapping the counts
+        with the given mode.
+        """
+        counts = np.load(os.path.join(path, COUNTS_FILENAME), mmap_mode=mmap_mode)
+        with open(os.path.join(path, AXES_FILENAME)) as fh:
+            axes = json.load(fh)
+
+        return cls(counts, list(pd.to_datetime(axes["dates"])), axes["variants"], axes["locations"])
+
+    def save(self, path: str) -> None:
+        """Save counts and axis labels to a bundle directory at the given path.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, COUNTS_FILENAME), np.asarray(self.counts, dtype=np.float32))
+        with open(os.path.join(path, AXES_FILENAME), "w") as fh:
+            json.dump(
+                {
+                    "dates": [date.strftime("%Y-%m-%d") for date in self.dates],
+                    "variants": self.variants,
+                    "locations": self.locations,
+                },
+                fh,
+            )
+
+    def subset_locations(self, locations) -> "CountTensor":
+        """Return counts for the given locations with the variants and dates
+        that would remain after subsetting the original sequence counts table
+        to these locations. Axes that keep all of their entries stay views of
+        the original counts.
+        """
+        counts = self.counts
+        locations = set(locations)
+        location_indices = [index for index, location in enumerate(self.locations) if location in locations]
+        if len(location_indices) < len(self.locations):
+            counts = counts[..., location_indices]
+
+        # Drop variants without any sequences in these locations
+        variant_indices = np.flatnonzero(np.nansum(counts, axis=(0, 2)) > 0)
+        if len(variant_indices) < len(self.variants):
+            counts = counts[:, variant_indices, :]
+
+        # Trim dates before the first or after the last date with sequences
+        observed_dates = np.flatnonzero(~np.isnan(counts[:, 0, :]).all(axis=-1))
+        start, end = observed_dates[0], observed_dates[-1] + 1
+        if start > 0 or end < len(self.dates):
+            counts = counts[start:end]
+
+        return CountTensor(
+            counts,
+            self.dates[start:end],
+            [self.variants[index] for index in variant_indices],
+            [self.locations[index] for index in location_indices],
+        )
+
+    def truncate(self, max_date) -> "CountTensor":
+        """Return a view of the counts up to and including the given date with
+        the same variants and locations.
+        """
+        end = pd.DatetimeIndex(self.dates).searchsorted(pd.Timestamp(max_date), side="right")
+        return CountTensor(self.counts[:end], self.dates[:end], self.variants, self.locations)
+
+    def sequences_by_location_and_variant(self) -> dict:
+        """Return total sequences of each variant with sequences in each
+        location keyed by location and variant.
+        """
+        totals = np.nansum(self.counts, axis=0)
+        variant_indices, location_indices = np.nonzero(totals > 0)
+        return {
+            (self.locations[g], self.variants[v]): int(totals[v, g])
+            for v, g in zip(variant_indices, location_indices)
+        }
+
+    def to_seq_counts(self) -> pd.DataFrame:
+        """Return a sequence counts table with columns 'location', 'variant',
+        'date', and 'sequences' with one row per nonzero count.
+        """
+        t, v, g = np.nonzero(np.nan_to_num(self.counts) > 0)
+        return pd.DataFrame({
+            "location": np.array(self.locations, dtype=object)[g],
+            "variant": np.array(self.variants, dtype=object)[v],
+            "date": pd.DatetimeIndex(self.dates)[t].strftime("%Y-%m-%d"),
+            "sequences": np.asarray(self.counts[t, v, g]).astype(np.int64),
+        }).sort_values(["location", "variant", "date"], ignore_index=True)
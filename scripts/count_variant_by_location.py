@@ -2,8 +2,79 @@
 # Script from ChatGPT
 import argparse
 import sys
-from typing import Optional, List
+from typing import Optional, List, Tuple
+import numpy as np
 import pandas as pd
+from count_tensor import CountTensor, is_count_tensor
+from profiling import profile_from_environment
+
+def count_table_by_region(
+    tsv_file: str,
+    clade_name: Optional[str],
+    cutoff: Optional[pd.Timestamp],
+) -> Optional[Tuple[pd.Series, pd.Series]]:
+    """
+    Sum sequences of the selected clade and of all clades per region from a
+    TSV with columns: location, clade, date (YYYY-MM-DD), sequences.
+    Returns None when no rows remain after the date filter.
+    """
+    # Load
+    df = pd.read_csv(tsv_file, sep="\t")
+    required_cols = {"location", "clade", "date", "sequences"}
+    missing = required_cols - set(df.columns)
+    if missing:
+        print(f"Error: TSV missing required columns: {', '.join(sorted(missing))}", file=sys.stderr)
+        sys.exit(2)
+
+    # Optional date filter
+    if cutoff is not None:
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        df = df[df["date"] >= cutoff]
+
+    if df.empty:
+        return None
+
+    # Compute counts
+    if clade_name is not None:
+        clade_df = df[df["clade"] == clade_name]
+        clade_counts = clade_df.groupby("location")["sequences"].sum()
+    else:
+        clade_counts = pd.Series(dtype=float)
+
+    total_counts = df.groupby("location")["sequences"].sum()
+    return clade_counts, total_counts
+
+
+def count_tensor_by_region(
+    bundle: str,
+    clade_name: Optional[str],
+    cutoff: Optional[pd.Timestamp],
+) -> Optional[Tuple[pd.Series, pd.Series]]:
+    """
+    Sum sequences of the selected variant and of all variants per region from
+    a count tensor bundle written by prepare-data.py without building a table.
+    Returns None when no dates with sequences remain after the date filter.
+    """
+    tensor = CountTensor.load(bundle)
+    counts = tensor.counts
+    if cutoff is not None:
+        counts = counts[pd.DatetimeIndex(tensor.dates) >= cutoff]
+
+    # Only regions with sequences after the date filter have rows in a table
+    observed = ~np.isnan(counts[:, 0, :]).all(axis=0)
+    if not observed.any():
+        return None
+
+    locations = [location for location, is_observed in zip(tensor.locations, observed) if is_observed]
+    if clade_name in tensor.variants:
+        clade_totals = np.nansum(counts[:, tensor.variants.index(clade_name), :], axis=0)
+        clade_counts = pd.Series(clade_totals[observed], index=locations)
+    else:
+        clade_counts = pd.Series(dtype=float)
+
+    total_counts = pd.Series(np.nansum(counts, axis=(0, 1))[observed], index=locations)
+    return clade_counts, total_counts
+
 
 def count_clade_by_region(
     tsv_file: str,
@@ -13,12 +84,12 @@ def count_clade_by_region(
 ) -> None:
     """
     Read a TSV with columns: location, clade, date (YYYY-MM-DD), sequences
-    and print a per-region table of counts and percentages for the selected clade.
+    or a count tensor bundle from prepare-data.py and print a per-region table of counts and percentages for the selected clade.
 
     Parameters
     ----------
     tsv_file : str
-        Path to input TSV.
+        Path to input TSV or count tensor bundle directory.
     clade_name : Optional[str]
         Clade to count (exact match). If None, counts will be zero in the clade column.
     min_date : Optional[str]
@@ -27,35 +98,24 @@ def count_clade_by_region(
     min_total_count : int
         Minimum total sequences required for a region to be shown (after filters).
     """
-    # Load
-    df = pd.read_csv(tsv_file, sep="\t")
-    required_cols = {"location", "clade", "date", "sequences"}
-    missing = required_cols - set(df.columns)
-    if missing:
-        print(f"Error: TSV missing required columns: {', '.join(sorted(missing))}", file=sys.stderr)
-        sys.exit(2)
-
-    # Optional date filter
+    # Validate the optional date filter
+    cutoff = None
     if min_date:
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
         cutoff = pd.to_datetime(min_date, errors="coerce")
         if pd.isna(cutoff):
             print(f"Error: --min-date '{min_date}' is not a valid date (expected YYYY-MM-DD).", file=sys.stderr)
             sys.exit(2)
-        df = df[df["date"] >= cutoff]
 
-    if df.empty:
+    if is_count_tensor(tsv_file):
+        counts = count_tensor_by_region(tsv_file, clade_name, cutoff)
+    else:
+        counts = count_table_by_region(tsv_file, clade_name, cutoff)
+
+    if counts is None:
         print("No data after applying filters.")
         return
 
-    # Compute counts
-    if clade_name is not None:
-        clade_df = df[df["clade"] == clade_name]
-        clade_counts = clade_df.groupby("location")["sequences"].sum()
-    else:
-        clade_counts = pd.Series(dtype=float)
-
-    total_counts = df.groupby("location")["sequences"].sum()
+    clade_counts, total_counts = counts
 
     # Apply min_total_count threshold to region list
     regions = [loc for loc, total in total_counts.items() if int(total) >= min_total_count]
@@ -89,7 +149,7 @@ def main(argv: Optional[List[str]] = None) -> None:
     parser = argparse.ArgumentParser(
         description="Count a clade by region from a TSV of sequence counts."
     )
-    parser.add_argument("tsv_file", help="Path to TSV (with columns: location, clade, date, sequences)")
+    parser.add_argument("tsv_file", help="Path to TSV (with columns: location, clade, date, sequences) or count tensor bundle from prepare-data.py")
     parser.add_argument(
         "--clade",
         dest="clade",
@@ -119,4 +179,5 @@ def main(argv: Optional[List[str]] = None) -> None:
 
 
 if __name__ == "__main__":
+    profile_from_environment(__file__)
     main()
@@ -1,6 +1,7 @@
 import pandas as pd
 import argparse
 import os
+from profiling import profile_from_environment
 
 def get_location(data, min_seq, out_dir):
     """ Returns <location>.lst (country or region) of countries with a month with a peak greater than the <threshold> of sequences per month."""
@@ -19,6 +20,7 @@ def get_location(data, min_seq, out_dir):
 
 
 if __name__ == "__main__":
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(description="Get locations with min mean seq per month")
     parser.add_argument("-i", "--input_seqs", type=str, required=True, help="Variant sequence counts TSV file")
     parser.add_argument("-t", "--threshold", type=float, required=True, default=20, help="Threshold for sequences per month per location")
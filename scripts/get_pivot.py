@@ -2,6 +2,7 @@ import argparse
 import yaml
 import os
 import pandas as pd
+from profiling import profile_from_environment
 
 def function_name(input, output):
     """
@@ -19,6 +20,7 @@ def function_name(input, output):
 
 
 if __name__ == "__main__":
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("--input_file", required=True, help="Path to MLR config with pivot.")
     parser.add_argument("--output_file", required=True, help="Output path to pivot TXT file.")
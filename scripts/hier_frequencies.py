@@ -8,11 +8,50 @@ from evofr.data import (
     DataSpec,
     prep_dates,
     format_var_names,
-    VariantFrequencies,
 )
 
+from count_tensor import CountTensor, counts_to_tensor
 import temporal_aggregation
 
+
+class GroupFrequencies:
+    def __init__(self, seq_counts, dates, date_to_index, var_names):
+        """Lightweight view of the variant frequencies for a single group in a
+        hierarchical data set with the attributes used to export results.
+
+        Parameters
+        ----------
+        seq_counts:
+            array of sequence counts with shape (time, variants).
+
+        dates:
+            list of dates for the time axis of the counts.
+
+        date_to_index:
+            dictionary mapping dates to indices of the time axis.
+
+        var_names:
+            list of variant names for the variant axis of the counts.
+
+        Returns
+        -------
+        GroupFrequencies
+        """
+        self.seq_counts = seq_counts
+        self.dates = dates
+        self.date_to_index = date_to_index
+        self.var_names = var_names
+        self.pivot = var_names[-1]
+
+    def make_data_dict(self, data: Optional[dict] = None) -> dict:
+        if data is None:
+            data = dict()
+        data["seq_counts"] = self.seq_counts
+        data["N"] = self.seq_counts.sum(axis=-1)
+        data["var_names"] = self.var_names
+        return data
+
+
 class HierFrequencies(DataSpec):
     def __init__(
         self,
@@ -69,14 +108,66 @@ class HierFrequencies(DataSpec):
         self.var_names = format_var_names(raw_var_names, pivot=pivot)
         self.pivot = self.var_names[-1]
 
-        # Loop each group
-        grouped = raw_seq.groupby(group)
-        self.names = [name for name, _ in grouped]
-        self.groups = [
-            VariantFrequencies(group, self.date_to_index, self.var_names)
-            for _, group in grouped
-        ]
+        # Count sequences by date, variant, and group at once
+        group_codes, names = pd.factorize(raw_seq[group], sort=True)
+        self.names = list(names)
+        observed_group = group_codes >= 0
+        seq_counts = counts_to_tensor(
+            raw_seq[observed_group],
+            group_codes[observed_group],
+            len(self.names),
+            self.date_to_index,
+            self.var_names,
+        )
+
+        self._aggregate_and_split(seq_counts, max_date, aggregation_frequency)
 
+    @classmethod
+    def from_count_tensor(
+        cls,
+        count_tensor: CountTensor,
+        pivot: Optional[str] = None,
+        max_date: Optional[str] = None,
+        aggregation_frequency: Optional[str] = None,
+    ) -> "HierFrequencies":
+        """Construct hierarchical frequencies grouped by location from a count
+        tensor instead of a dataframe of sequence counts.
+
+        Parameters
+        ----------
+        count_tensor:
+            counts by date, variant, and location as prepared by
+            `prepare-data.py`.
+
+        pivot:
+            optional name of variant to place last.
+
+        max_date:
+            optional date or backwards looking relative ISO 8601 duration
+            to use as the latest date for observed frequency estimates.
+
+        aggregation_frequency:
+            optional temporal frequency used to aggregate daily counts.
+
+        Returns
+        -------
+        HierFrequencies
+        """
+        data = cls.__new__(cls)
+        data.dates = list(count_tensor.dates)
+        data.date_to_index = {d: i for (i, d) in enumerate(data.dates)}
+        data.var_names = format_var_names(list(count_tensor.variants), pivot=pivot)
+        data.pivot = data.var_names[-1]
+        data.names = list(count_tensor.locations)
+
+        # Order variants with the pivot last
+        variant_order = [count_tensor.variants.index(name) for name in data.var_names]
+        seq_counts = np.asarray(count_tensor.counts[:, variant_order, :], dtype=float)
+
+        data._aggregate_and_split(seq_counts, max_date, aggregation_frequency)
+        return data
+
+    def _aggregate_and_split(self, seq_counts, max_date, aggregation_frequency):
         # Aggregate counts into larger windows
 
         if max_date is not None:
@@ -98,26 +189,68 @@ class HierFrequencies(DataSpec):
 
         self.aggregation_frequency = aggregation_frequency
         if self.aggregation_frequency is not None:
+            # Aggregate counts of all variants and groups at once
             (
-                self.groups,
+                seq_counts,
                 self.dates,
                 self.date_to_index,
-            ) = temporal_aggregation.aggregate_temporally_hierarchical(
-                self.groups, self.dates, self.max_date, self.aggregation_frequency
+            ) = temporal_aggregation.aggregate_temporally(
+                seq_counts, self.dates, self.max_date, self.aggregation_frequency
             )
 
-        self.seq_counts = np.stack(
-            [g.seq_counts for g in self.groups], axis=-1
+        # Views of the counts of each group for exporting results by group
+        self.seq_counts = seq_counts
+        self.groups = [
+            GroupFrequencies(seq_counts[..., g], self.dates, self.date_to_index, self.var_names)
+            for g in range(len(self.names))
+        ]
+
+    def save(self, path: str) -> None:
+        """Save aggregated counts and their axes (dates, variants, and groups)
+        to a compressed ``.npz`` archive, so results can be exported later
+        without rebuilding the data from the original sequence counts.
+        """
+        np.savez_compressed(
+            path,
+            seq_counts=self.seq_counts,
+            dates=pd.DatetimeIndex(self.dates).values.astype("datetime64[D]"),
+            var_names=np.array(self.var_names),
+            names=np.array(self.names),
+            max_date=np.array(pd.Timestamp(self.max_date).strftime("%Y-%m-%d")),
+            aggregation_frequency=np.array(self.aggregation_frequency or ""),
         )
 
+    @classmethod
+    def load(cls, path: str) -> "HierFrequencies":
+        """Load data saved by `HierFrequencies.save`.
+        """
+        with np.load(path) as archive:
+            seq_counts = archive["seq_counts"]
+            dates = list(pd.to_datetime(archive["dates"]))
+            var_names = archive["var_names"].tolist()
+            names = archive["names"].tolist()
+            max_date = pd.Timestamp(str(archive["max_date"]))
+            aggregation_frequency = str(archive["aggregation_frequency"]) or None
+
+        data = cls.__new__(cls)
+        data.dates = dates
+        data.date_to_index = {d: i for (i, d) in enumerate(dates)}
+        data.var_names = var_names
+        data.pivot = var_names[-1]
+        data.names = names
+        data.max_date = max_date
+        data.aggregation_frequency = aggregation_frequency
+        data.seq_counts = seq_counts
+        data.groups = [
+            GroupFrequencies(seq_counts[..., g], dates, data.date_to_index, var_names)
+            for g in range(len(names))
+        ]
+        return data
+
     def make_data_dict(self, data: Optional[dict] = None) -> dict:
         if data is None:
             data = dict()
-        data["seq_counts"] = np.stack(
-            [g.seq_counts for g in self.groups], axis=-1
-        )
-        data["N"] = np.stack(
-            [g.seq_counts.sum(axis=-1) for g in self.groups], axis=-1
-        )
+        data["seq_counts"] = self.seq_counts
+        data["N"] = self.seq_counts.sum(axis=1)
         data["var_names"] = self.var_names
         return data
@@ -3,7 +3,8 @@ from typing import Optional
 import numpy as np
 from jax import vmap
 import jax.numpy as jnp
-from jax.nn import softmax
+from jax.nn import log_softmax, softmax
+from jax.scipy.special import gammaln, logsumexp
 
 import numpyro
 import numpyro.distributions as dist
@@ -12,6 +13,61 @@ from numpyro.infer.reparam import TransformReparam
 from evofr import ModelSpec
 from evofr import MultinomialLogisticRegression
 import circulation_windows
+
+# Logit assigned to variants outside of their circulation window, so they
+# receive exactly zero probability without producing infinities.
+MASKED_LOGIT = -1e30
+
+
+def mask_non_circulating(logits, circulation_mask, windowed=False, simple_exclusion=False):
+    """
+    Exclude variants outside of their circulation window from the given logits.
+    The circulation mask must broadcast against the logits.
+    """
+    if windowed:
+        return jnp.where(circulation_mask, logits, MASKED_LOGIT)
+    if simple_exclusion:
+        return jnp.where(circulation_mask, logits, -10.0)
+    return logits
+
+
+def mlr_windowed_likelihood(seq_counts, N, logits, pred):
+    """
+    Evaluate the multinomial likelihood among circulating variants for all time points and groups at once.
+    Logits of non-circulating variants are expected to be masked, which makes this equivalent
+    to evaluating a separate multinomial likelihood for each window of circulating variants.
+    """
+    freq = softmax(logits, axis=1)
+
+    if pred:
+        _seq_counts = numpyro.sample(
+            "_seq_counts",
+            dist.MultinomialLogits(
+                logits=logits.swapaxes(1, 2), total_count=np.nan_to_num(N)
+            ),
+        )
+        return freq, jnp.swapaxes(_seq_counts, 1, 2)
+
+    # Non-circulating variants have no counts, so masked logits never contribute
+    obs = np.nan_to_num(seq_counts)
+    log_normalizer = gammaln(np.nan_to_num(N) + 1).sum() - gammaln(obs + 1).sum()
+    numpyro.factor(
+        "_seq_counts",
+        log_normalizer + jnp.sum(obs * log_softmax(logits, axis=1)),
+    )
+    return freq, obs
+
+
+def sample_overdispersion(xi_prior, xi_by_group, N_groups):
+    """
+    Sample over-dispersion of sequence counts either shared across or by group.
+    """
+    if xi_by_group:
+        with numpyro.plate("group", N_groups, dim=-1):
+            return numpyro.sample("xi", dist.Beta(1, xi_prior))
+    return numpyro.sample("xi", dist.Beta(1, xi_prior))
+
+
 def mlr_hier_likelihood(seq_counts, N, logits, pred, xi_prior, xi_by_group, N_groups):
     obs = None if pred else np.swapaxes(np.nan_to_num(seq_counts), 1, 2)
     if xi_prior is None:
@@ -28,13 +84,10 @@ def mlr_hier_likelihood(seq_counts, N, logits, pred, xi_prior, xi_by_group, N_gr
         seq_counts_gen = jnp.swapaxes(_seq_counts, 1, 2)
     else:
         # Overdispersion in sequence counts
+        xi = sample_overdispersion(xi_prior, xi_by_group, N_groups)
+        trans_xi = jnp.reciprocal(xi) - 1
         if xi_by_group:
-            with numpyro.plate("group", N_groups, dim=-1):
-                xi = numpyro.sample("xi", dist.Beta(1, xi_prior))
-            trans_xi = (jnp.reciprocal(xi) - 1)[None, :, None]
-        else:
-            xi = numpyro.sample("xi", dist.Beta(1, xi_prior))
-            trans_xi = jnp.reciprocal(xi) - 1
+            trans_xi = trans_xi[None, :, None]
 
         # Evaluate dirichlet multinomial likelihood
         freq = softmax(logits, axis=1)
@@ -50,12 +103,76 @@ def mlr_hier_likelihood(seq_counts, N, logits, pred, xi_prior, xi_by_group, N_gr
     return freq, seq_counts_gen
 
 
+def mlr_sparse_likelihood(
+    seq_counts, N, logits, pred, xi_prior, xi_by_group, N_groups, observed_cells
+):
+    """
+    Evaluate the likelihood only over (time, group) cells with observed sequences.
+    Logits are gathered into shape (cells, variants) so the cost scales with the number of observations.
+    Cells without sequences contribute nothing to the likelihood and generate zero counts.
+    """
+    obs_t, obs_g = observed_cells
+    _logits = logits[obs_t, :, obs_g]  # (K, V)
+    _N = np.nan_to_num(N)[obs_t, obs_g]
+    obs = None if pred else np.nan_to_num(seq_counts)[obs_t, :, obs_g]
+
+    if xi_prior is None:
+        # Evaluate multinomial likelihood
+        _seq_counts = numpyro.sample(
+            "_seq_counts",
+            dist.MultinomialLogits(logits=_logits, total_count=_N),
+            obs=obs,
+        )
+    else:
+        # Overdispersion in sequence counts
+        xi = sample_overdispersion(xi_prior, xi_by_group, N_groups)
+        trans_xi = jnp.reciprocal(xi) - 1
+        if xi_by_group:
+            trans_xi = trans_xi[obs_g, None]
+
+        # Evaluate dirichlet multinomial likelihood
+        _seq_counts = numpyro.sample(
+            "_seq_counts",
+            dist.DirichletMultinomial(
+                concentration=1e-8 + trans_xi * softmax(_logits, axis=-1),
+                total_count=_N,
+            ),
+            obs=obs,
+        )
+
+    freq = softmax(logits, axis=1)
+    if pred:
+        seq_counts_gen = jnp.zeros_like(logits).at[obs_t, :, obs_g].set(_seq_counts)
+    else:
+        seq_counts_gen = np.nan_to_num(seq_counts)
+    return freq, seq_counts_gen
+
+
+def mlr_sufficient_statistics_likelihood(seq_counts, N, beta, logits, count_stats, observed_cells=None):
+    """
+    Evaluate the multinomial log-likelihood up to constants from the sufficient statistics of the counts.
+    Since logits are linear in the features, the counts only enter through count_stats = X^T counts
+    and the log-likelihood is sum(beta * count_stats) - sum(N * logsumexp(logits)).
+    Masked logits of non-circulating variants only enter the normalizing term as they have no counts.
+    """
+    N = np.nan_to_num(N)
+    if observed_cells is not None:
+        # Only cells with observed sequences contribute to the normalizing term
+        obs_t, obs_g = observed_cells
+        log_normalizer = jnp.sum(N[obs_t, obs_g] * logsumexp(logits[obs_t, :, obs_g], axis=-1))
+    else:
+        log_normalizer = jnp.sum(N * logsumexp(logits, axis=1))
+
+    numpyro.factor(
+        "_seq_counts", jnp.einsum("fvg, fvg ->", beta, count_stats) - log_normalizer
+    )
+    return softmax(logits, axis=1), np.nan_to_num(seq_counts)
+
+
 def hier_MLR_numpyro(
     seq_counts,
     N,
     X,
-    circulating_at_time,
-    circulating_periods,
     circulation_mask,
     tau=None,
     pool_scale=None,
@@ -65,6 +182,9 @@ def hier_MLR_numpyro(
     var_names=None,
     windowed=False,
     simple_exclusion=False,
+    deterministic_sites=None,
+    observed_cells=None,
+    count_stats=None,
 ):
     _, N_variants, N_groups = seq_counts.shape
     _, N_features, _ = X.shape
@@ -130,52 +250,63 @@ def hier_MLR_numpyro(
     dot_by_group = vmap(jnp.dot, in_axes=(-1, -1), out_axes=-1)
     logits = dot_by_group(X, beta)  # Logit frequencies by variant
 
-    if windowed:
-        freq = jnp.zeros_like(logits)
-        seq_counts_gen = jnp.zeros_like(logits)
-
-        # Evaluate likelihood
-        obs = None if pred else np.nan_to_num(seq_counts)
-        for p, (t, circulating) in enumerate(circulating_periods):
-            _logits = logits[t[:, None], circulating, :]
-            _seq_counts = numpyro.sample(
-                f"_seq_counts_{p}",
-                dist.MultinomialLogits(
-                    logits=_logits.swapaxes(1, 2),
-                    total_count=np.nan_to_num(N[t, :]),
-                ),
-                obs=None if pred else obs[t[:, None], circulating, :].swapaxes(1, 2),
-            )
+    # Only record the requested deterministic sites in the posterior.
+    # Others can be computed from beta after sampling.
+    def retain(site):
+        return deterministic_sites is None or site in deterministic_sites
 
-            freq = freq.at[t[:, None], circulating, :].set(softmax(_logits, axis=1))
-            seq_counts_gen = seq_counts_gen.at[t[:, None], circulating, :].set(
-                jnp.swapaxes(_seq_counts, 1, 2)
-            )
-    elif simple_exclusion:
-        logits = logits.at[~circulation_mask, :].set(-10)
-        freq = jnp.full_like(logits, jnp.nan)
-        seq_counts_gen = jnp.zeros_like(logits)
+    logits = mask_non_circulating(
+        logits, circulation_mask[:, :, None], windowed, simple_exclusion
+    )
 
-        # Evaluate likelihood
-        freq, seq_counts_gen = mlr_hier_likelihood(
-            seq_counts, N, logits, pred, xi_prior, xi_by_group, N_groups
+    if pred and not retain("seq_counts"):
+        # Skip generating sequence counts that would not be recorded
+        freq, seq_counts_gen = softmax(logits, axis=1), None
+    elif count_stats is not None and not pred:
+        # Evaluate multinomial likelihood from sufficient statistics
+        freq, seq_counts_gen = mlr_sufficient_statistics_likelihood(
+            seq_counts, N, beta, logits, count_stats, observed_cells
+        )
+    elif observed_cells is not None:
+        # Evaluate likelihood over observed cells only.
+        # The windowed model does not model over-dispersion.
+        freq, seq_counts_gen = mlr_sparse_likelihood(
+            seq_counts,
+            N,
+            logits,
+            pred,
+            None if windowed else xi_prior,
+            xi_by_group,
+            N_groups,
+            observed_cells,
         )
+    elif windowed:
+        # Evaluate likelihood among circulating variants
+        freq, seq_counts_gen = mlr_windowed_likelihood(seq_counts, N, logits, pred)
     else:
         # Evaluate likelihood
         freq, seq_counts_gen = mlr_hier_likelihood(
             seq_counts, N, logits, pred, xi_prior, xi_by_group, N_groups
         )
 
+    if windowed:
+        # Frequencies are only defined among circulating variants
+        freq = jnp.where(circulation_mask[:, :, None], freq, 0.0)
+
     # Compute frequency
-    numpyro.deterministic("freq", freq)
-    numpyro.deterministic("seq_counts", seq_counts_gen)
+    if retain("freq"):
+        numpyro.deterministic("freq", freq)
+    if retain("seq_counts"):
+        numpyro.deterministic("seq_counts", seq_counts_gen)
 
     # Compute growth advantage from model
     if tau is not None:
-        numpyro.deterministic(
-            "ga", jnp.exp(beta[-1, :-1, :] * tau)
-        )  # Last row corresponds to linear predictor / growth advantage
-        numpyro.deterministic("ga_loc", jnp.exp(beta_loc[:, 0] * tau))
+        if retain("ga"):
+            numpyro.deterministic(
+                "ga", jnp.exp(beta[-1, :-1, :] * tau)
+            )  # Last row corresponds to linear predictor / growth advantage
+        if retain("ga_loc"):
+            numpyro.deterministic("ga_loc", jnp.exp(beta_loc[:, 0] * tau))
 
 
 class HierMLR(ModelSpec):
@@ -189,6 +320,9 @@ class HierMLR(ModelSpec):
         right_buffer: Optional[int] = None,
         windowed: bool = False,
         simple_exclusion: bool = False,
+        deterministic_sites: Optional[list] = None,
+        sparse_likelihood: bool = False,
+        sufficient_statistics: bool = False,
     ) -> None:
         """Construct ModelSpec for Hierarchial multinomial logistic regression.
 
@@ -213,6 +347,19 @@ class HierMLR(ModelSpec):
         right_buffer:
             Time points proceeding last observation to include variant in.
 
+        deterministic_sites:
+            Names of deterministic sites ('freq', 'seq_counts', 'ga', 'ga_loc') to record for each posterior sample.
+            All sites are recorded if this is left as None.
+            Sites that are not recorded can be computed from 'beta' after sampling with `compute_site`.
+
+        sparse_likelihood:
+            Whether to evaluate the likelihood only over time points and groups with observed sequences.
+            This is faster when most cells of the count array are empty such as for country-level fits.
+
+        sufficient_statistics:
+            Whether to evaluate the multinomial likelihood from sufficient statistics of the counts.
+            This skips normalizing constants which do not depend on parameters and requires no over-dispersion.
+
         Returns
         -------
         HierMLR
@@ -226,11 +373,20 @@ class HierMLR(ModelSpec):
             pool_scale=self.pool_scale,
             xi_prior=self.xi_prior,
             xi_by_group=self.xi_by_group,
+            deterministic_sites=deterministic_sites,
         )
+        self.deterministic_sites = deterministic_sites
         self.left_buffer = left_buffer if left_buffer is not None else 0
         self.right_buffer = right_buffer if right_buffer is not None else 0
         self.windowed = windowed
         self.simple_exclusion = simple_exclusion
+        self.sparse_likelihood = sparse_likelihood
+
+        if sufficient_statistics and xi_prior is not None and not windowed:
+            raise ValueError(
+                "Sufficient statistics can only be used without over-dispersion (xi_prior)."
+            )
+        self.sufficient_statistics = sufficient_statistics
 
     @staticmethod
     def make_ols_feature(start, stop, n_groups):
@@ -252,29 +408,98 @@ class HierMLR(ModelSpec):
 
     def augment_data(self, data: dict) -> None:
         T, G = data["N"].shape
+        self.N_time = T
         data["tau"] = self.tau
         data["X"] = self.make_ols_feature(0, T, G)
-        (
-            data["circulating_at_time"],
-            data["circulation_mask"],
-        ) = circulation_windows.find_circulating_at_time(
+        data["circulation_mask"] = circulation_windows.find_circulation_mask(
             data["seq_counts"], self.left_buffer, self.right_buffer
         )
-        data["circulating_periods"] = circulation_windows.generate_minimal_windows(
-            data["circulating_at_time"]
-        )
         data["windowed"] = self.windowed
         data["simple_exclusion"] = self.simple_exclusion
 
-    @staticmethod
-    def forecast_frequencies(samples, forecast_L):
+        # Compact (time, group) cells with observed sequences
+        if self.sparse_likelihood:
+            data["observed_cells"] = np.nonzero(np.nan_to_num(data["N"]) > 0)
+
+        # Counts only enter the multinomial likelihood through X^T counts
+        if self.sufficient_statistics:
+            data["count_stats"] = np.einsum(
+                "tfg, tvg -> fvg", data["X"], np.nan_to_num(data["seq_counts"])
+            )
+
+    def circulation_mask(self, seq_counts):
+        """
+        Return the circulation mask of the given sequence counts, reusing the
+        mask of the previous call for the same counts, such as when computing
+        sites for each group of the same fit.
+        """
+        cached = getattr(self, "_circulation_mask", None)
+        if cached is None or cached[0] is not seq_counts:
+            mask = circulation_windows.find_circulation_mask(
+                seq_counts, self.left_buffer, self.right_buffer
+            )
+            self._circulation_mask = cached = (seq_counts, mask)
+        return cached[1]
+
+    def compute_site(self, samples, seq_counts, site, group=None):
+        """
+        Compute a deterministic site that was not recorded during sampling from posterior beta.
+
+        Parameters
+        ----------
+        samples:
+            Posterior samples including 'beta' and 'beta_loc'.
+
+        seq_counts:
+            Sequence counts the model was fit to with shape (T, V, G).
+
+        site:
+            Name of the site to compute: 'freq', 'ga', or 'ga_loc'.
+
+        group:
+            Optional index of the group to compute the site for.
+            Sites are computed for all groups if this is left as None.
+
+        Returns
+        -------
+        Array of samples for the site with the group axis last unless a single group was requested.
+        """
+        beta = jnp.asarray(samples["beta"])  # (S, F, V, G)
+        if group is not None:
+            beta = beta[..., group, None]
+
+        if site == "freq":
+            T = seq_counts.shape[0]
+            X = self.make_ols_feature(0, T, beta.shape[-1])
+            logits = jnp.einsum("tfg, sfvg -> stvg", X, beta)
+
+            # Apply the same exclusion of non-circulating variants used in fitting
+            circulation_mask = self.circulation_mask(seq_counts)[None, :, :, None]
+            logits = mask_non_circulating(
+                logits, circulation_mask, self.windowed, self.simple_exclusion
+            )
+            values = softmax(logits, axis=-2)
+
+            if self.windowed:
+                # Frequencies are only defined among circulating variants
+                values = jnp.where(circulation_mask, values, 0.0)
+        elif site == "ga":
+            values = jnp.exp(beta[:, -1, :-1, :] * self.tau)
+        elif site == "ga_loc":
+            return jnp.exp(jnp.asarray(samples["beta_loc"])[..., 0] * self.tau)
+        else:
+            raise ValueError(f"The site '{site}' cannot be computed from posterior beta.")
+
+        return values[..., 0] if group is not None else values
+
+    def forecast_frequencies(self, samples, forecast_L):
         """
         Use posterior beta to forecast posterior frequencies.
         """
 
         # Making feature matrix for forecasting
-        last_T = samples["freq"].shape[1]
-        n_groups = samples["freq"].shape[-1]
+        last_T = samples["freq"].shape[1] if "freq" in samples else self.N_time
+        n_groups = samples["beta"].shape[-1]
 
         X = HierMLR.make_ols_feature(
             start=last_T, stop=last_T + forecast_L, n_groups=n_groups
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Count sequences per location, haplotype, and date incrementally.
+
+Replaces filtering metadata, assigning emerging and amino acid haplotypes, and
+summarizing sequence counts for the full metadata history on every run. A
+count store directory keeps an append-only log of each strain's content hash,
+filter status, location, date, and haplotypes, along with the aggregated
+counts. Each run hashes the current metadata records, filters and assigns
+haplotypes to only the new or changed records, and updates the counts by the
+difference between their new and previous assignments. Strains that disappear
+from the metadata get removed from the counts.
+
+Changes to the haplotype definitions, the filter query, or any other setting
+that affects assignments cause the store to be rebuilt from scratch.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+
+from assign_aa_haplotypes import create_haplotype_for_record
+from assign_haplotypes import assign_haplotype, read_haplotype_definitions
+from profiling import profile_from_environment
+from relative_dates import parse_date_bound
+
+LOG_FILENAME = "assignments.tsv"
+COUNTS_FILENAME = "counts.tsv"
+STATE_FILENAME = "store.json"
+COUNT_KEYS = ["geo_resolution", "variant_classification", "location", "clade", "date"]
+
+# Log entries with an empty hash mark strains removed from the metadata
+DELETED_HASH = ""
+
+
+def settings_hash(settings, haplotypes_path):
+    """Return a hash of the settings and haplotype definitions that determine
+    the assignments of each record.
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    with open(haplotypes_path, "rb") as fh:
+        digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def latest_assignments(log):
+    """Return the latest assignment of each strain in the log that has not been
+    removed from the metadata.
+    """
+    latest = log.drop_duplicates("strain", keep="last")
+    return latest[latest["record_hash"] != DELETED_HASH]
+
+
+def count_sequences(assignments, location_columns, variant_classifications):
+    """Count sequences that passed the filters per geographic resolution,
+    variant classification, location, clade, and date.
+    """
+    counted = assignments[(assignments["counted"] == "1") & (assignments["date"] != "")]
+
+    counts = []
+    for location_column in location_columns:
+        for variant_classification in variant_classifications:
+            records = counted.loc[
+                (counted[location_column] != "") & (counted[variant_classification] != ""),
+                [location_column, variant_classification, "date"],
+            ]
+            resolution_counts = records.groupby(
+                [location_column, variant_classification, "date"],
+            ).size().reset_index(name="sequences").rename(
+                columns={location_column: "location", variant_classification: "clade"},
+            )
+            resolution_counts.insert(0, "geo_resolution", location_column)
+            resolution_counts.insert(1, "variant_classification", variant_classification)
+            counts.append(resolution_counts)
+
+    return pd.concat(counts, ignore_index=True)
+
+
+def update_counts(counts, added, removed):
+    """Add the given counts of new assignments to the stored counts and
+    subtract counts of the assignments they replace.
+    """
+    removed = removed.assign(sequences=-removed["sequences"])
+    counts = pd.concat([counts, added, removed], ignore_index=True).groupby(
+        COUNT_KEYS,
+        as_index=False,
+    )["sequences"].sum()
+    return counts[counts["sequences"] != 0]
+
+
+def assign_records(records, id_column, query, haplotype_definitions, clade_column, mutations_column, genes, location_columns):
+    """Filter the given metadata records and assign emerging and amino acid
+    haplotypes to the records that pass the filter.
+
+    Returns one log entry per record with its content hash, date, locations,
+    haplotypes, and whether it counts towards the sequence counts.
+    """
+    entries = pd.DataFrame({
+        "strain": records[id_column].values,
+        "record_hash": records["record_hash"].values,
+        "counted": "0",
+        # Only count records with complete dates like summarize-clade-sequence-counts
+        "date": pd.to_datetime(records["date"], format="%Y-%m-%d", errors="coerce").dt.strftime("%Y-%m-%d").fillna("").values,
+    })
+    for location_column in location_columns:
+        entries[location_column] = records[location_column].values
+    entries["emerging_haplotype"] = ""
+    entries["aa_haplotype"] = ""
+
+    passed = records.query(query).index
+    if len(passed) > 0:
+        passed_records = records.loc[passed]
+        passed_positions = records.index.get_indexer(passed)
+        entries.loc[passed_positions, "counted"] = "1"
+        entries.loc[passed_positions, "emerging_haplotype"] = passed_records.apply(
+            assign_haplotype,
+            axis=1,
+            haplotype_definitions=haplotype_definitions,
+            clade_column=clade_column,
+            default_haplotype="other",
+        ).values
+        entries.loc[passed_positions, "aa_haplotype"] = passed_records.apply(
+            create_haplotype_for_record,
+            axis=1,
+            clade_column=clade_column,
+            mutations_column=mutations_column,
+            genes=genes,
+            strip_genes=True,
+        ).values
+
+    return entries
+
+
+def write_table(table, path):
+    """Write the given table as TSV, replacing any existing file only after the
+    new file has been completely written.
+    """
+    table.to_csv(f"{path}.tmp", sep="\t", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+if __name__ == '__main__':
+    profile_from_environment(__file__)
+    parser = argparse.ArgumentParser(__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--metadata", required=True,
+        help="Path to TSV of metadata joined with Nextclade annotations for all sequences.")
+    parser.add_argument("--haplotypes", required=True,
+        help="TSV file of emerging haplotype definitions as used by assign_haplotypes.py.")
+    parser.add_argument("--store", required=True,
+        help="Directory of the count store that persists between runs.")
+    parser.add_argument("--id-column", default="strain",
+        help="Column with the unique id of each record.")
+    parser.add_argument("--query", required=True,
+        help="Pandas query that records must pass to be counted like the query of augur filter.")
+    parser.add_argument("--clade-column", default="subclade",
+        help="Column with clades used in the haplotype definitions.")
+    parser.add_argument("--mutations-column", default="founderMuts['subclade'].aaSubstitutions",
+        help="Column with amino acid mutations relative to each record's clade.")
+    parser.add_argument("--genes", nargs="+", default=["HA1"],
+        help="Genes whose mutations define amino acid haplotypes.")
+    parser.add_argument("--location-columns", nargs="+", default=["country", "region"],
+        help="Columns with locations to count sequences by.")
+    parser.add_argument("--min-date", required=True,
+        help="Earliest date of sequences in the output counts as YYYY-MM-DD or relative to today like '6M'.")
+    parser.add_argument("--max-date", required=True,
+        help="Latest date of sequences in the output counts as YYYY-MM-DD or relative to today like '0D'.")
+    parser.add_argument("--metadata-chunk-size", type=int, default=100000,
+        help="Maximum metadata records to read into memory at once.")
+    parser.add_argument("--output-seq-counts", required=True,
+        help="Path of output TSVs of sequence counts per location, clade, and date with "
+             "'{variant_classification}' and '{geo_resolution}' placeholders. "
+             "Counts get written for the 'emerging_haplotype' and 'aa_haplotype' variant classifications and each location column.")
+
+    args = parser.parse_args()
+
+    variant_classifications = ["emerging_haplotype", "aa_haplotype"]
+    log_path = os.path.join(args.store, LOG_FILENAME)
+    counts_path = os.path.join(args.store, COUNTS_FILENAME)
+    state_path = os.path.join(args.store, STATE_FILENAME)
+    log_columns = ["strain", "record_hash", "counted", "date"] + args.location_columns + variant_classifications
+
+    try:
+        haplotype_definitions = read_haplotype_definitions(args.haplotypes)
+    except ValueError as error:
+        print(f"ERROR: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    # Content hashes depend on the metadata columns, so adding or removing a
+    # column changes every hash and rebuilds the store too.
+    metadata_columns = list(pd.read_csv(args.metadata, sep="\t", nrows=0).columns)
+    current_settings_hash = settings_hash(
+        {
+            "id_column": args.id_column,
+            "query": args.query,
+            "clade_column": args.clade_column,
+            "mutations_column": args.mutations_column,
+            "genes": args.genes,
+            "location_columns": args.location_columns,
+            "metadata_columns": metadata_columns,
+        },
+        args.haplotypes,
+    )
+
+    # Load the store unless settings changed since it was written.
+    os.makedirs(args.store, exist_ok=True)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as fh:
+            state = json.load(fh)
+
+    if state.get("settings_hash") == current_settings_hash and os.path.exists(log_path):
+        log = pd.read_csv(log_path, sep="\t", dtype=str, na_filter=False)
+    else:
+        if state:
+            print("Settings or haplotype definitions changed since the last run, so rebuilding the count store.")
+        log = pd.DataFrame(columns=log_columns, dtype=str)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+    assignments = latest_assignments(log)
+
+    # Counts are only valid for the log they were computed from. Recount from
+    # the log if a previous run stopped between writing the two.
+    if state.get("log_entries") == len(log) and os.path.exists(counts_path):
+        counts = pd.read_csv(counts_path, sep="\t", dtype={key: str for key in COUNT_KEYS}, na_filter=False)
+    else:
+        counts = count_sequences(assignments, args.location_columns, variant_classifications)
+
+    # Find new or changed records by their content hash.
+    stored_hashes = assignments.set_index("strain")["record_hash"]
+    changed_chunks = []
+    seen_strains = []
+    metadata_reader = pd.read_csv(
+        args.metadata,
+        sep="\t",
+        dtype=str,
+        na_filter=False,
+        chunksize=args.metadata_chunk_size,
+    )
+    for metadata in metadata_reader:
+        record_hashes = pd.util.hash_pandas_object(metadata, index=False).astype(str).values
+        strains = metadata[args.id_column]
+        seen_strains.append(strains)
+
+        changed = stored_hashes.reindex(strains).values != record_hashes
+        if changed.any():
+            changed_chunks.append(metadata.loc[changed].assign(record_hash=record_hashes[changed]))
+
+    seen_strains = pd.concat(seen_strains, ignore_index=True) if seen_strains else pd.Series(dtype=str)
+    if seen_strains.duplicated().any():
+        print(
+            f"WARNING: Found duplicate records for {seen_strains.duplicated().sum()} strains; counting only the first record of each.",
+            file=sys.stderr,
+        )
+
+    if changed_chunks:
+        changed_records = pd.concat(changed_chunks, ignore_index=True).drop_duplicates(args.id_column)
+    else:
+        changed_records = pd.DataFrame(columns=metadata_columns + ["record_hash"], dtype=str)
+
+    deleted_strains = assignments.loc[~assignments["strain"].isin(seen_strains), "strain"]
+    print(
+        f"Found {len(changed_records)} new or changed records and {len(deleted_strains)} removed records "
+        f"out of {len(seen_strains)} records."
+    )
+
+    # Assign the new or changed records and update counts by the difference
+    # from their previous assignments.
+    new_entries = assign_records(
+        changed_records,
+        args.id_column,
+        args.query,
+        haplotype_definitions,
+        args.clade_column,
+        args.mutations_column,
+        args.genes,
+        args.location_columns,
+    )[log_columns]
+    deleted_entries = pd.DataFrame({"strain": deleted_strains.values}).reindex(columns=log_columns, fill_value="")
+    deleted_entries["counted"] = "0"
+    replaced_assignments = assignments[
+        assignments["strain"].isin(new_entries["strain"]) | assignments["strain"].isin(deleted_strains)
+    ]
+
+    counts = update_counts(
+        counts,
+        count_sequences(new_entries, args.location_columns, variant_classifications),
+        count_sequences(replaced_assignments, args.location_columns, variant_classifications),
+    )
+
+    # Append changes to the log or, once most of the log is outdated, rewrite
+    # the log with only the latest assignments.
+    log_updates = pd.concat([new_entries, deleted_entries], ignore_index=True)
+    n_log_entries = len(log) + len(log_updates)
+    n_assignments = len(assignments) + len(new_entries) - len(replaced_assignments)
+    if n_log_entries > 2 * n_assignments:
+        log = latest_assignments(pd.concat([log, log_updates], ignore_index=True))
+        write_table(log, log_path)
+        n_log_entries = len(log)
+    elif len(log_updates) > 0:
+        log_updates.to_csv(
+            log_path,
+            sep="\t",
+            index=False,
+            mode="a",
+            header=not os.path.exists(log_path),
+        )
+
+    write_table(counts, counts_path)
+    with open(state_path, "w") as fh:
+        json.dump({"settings_hash": current_settings_hash, "log_entries": n_log_entries}, fh, indent=2)
+
+    # Write counts within the requested dates for each variant classification
+    # and geographic resolution.
+    today = pd.Timestamp.today().normalize()
+    min_date = parse_date_bound(args.min_date, today)
+    max_date = parse_date_bound(args.max_date, today)
+    counts = counts[(counts["date"] >= min_date) & (counts["date"] <= max_date)]
+
+    for variant_classification in variant_classifications:
+        for location_column in args.location_columns:
+            output_path = args.output_seq_counts.format(
+                variant_classification=variant_classification,
+                geo_resolution=location_column,
+            )
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            counts.loc[
+                (counts["variant_classification"] == variant_classification) & (counts["geo_resolution"] == location_column),
+                ["location", "clade", "date", "sequences"],
+            ].sort_values(["location", "clade", "date"]).to_csv(
+                output_path,
+                sep="\t",
+                index=False,
+            )
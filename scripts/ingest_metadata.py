@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Join metadata with Nextclade annotations and filter the joined records in one
+streaming pass.
+
+Replaces decompressing the metadata and Nextclade annotations to disk, merging
+them into another full table, and filtering that table with augur filter. The
+inputs can be xz-compressed or uncompressed files or pipes (e.g., `<(aws s3 cp
+s3://... -)`). Only the requested columns of the Nextclade annotations and the
+columns used by the query get loaded into memory. Metadata records stream
+through in chunks, get joined with their annotations by strain name, and get
+filtered by the query and date range, so only the filtered table with the
+requested columns gets written to disk.
+
+Records need both metadata and Nextclade annotations to pass. When both inputs
+have a column, non-empty values from the Nextclade annotations take precedence.
+"""
+import argparse
+import io
+import lzma
+import re
+import sys
+
+import pandas as pd
+
+from profiling import profile_from_environment
+from relative_dates import parse_date_bound
+
+XZ_MAGIC = b"\xfd7zXZ\x00"
+
+
+def open_table(path):
+    """Open the given file or pipe as text, decompressing xz-compressed input
+    detected from its first bytes without seeking.
+    """
+    stream = open(path, "rb")
+    if stream.peek(len(XZ_MAGIC)).startswith(XZ_MAGIC):
+        stream = lzma.open(stream)
+
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+def read_header(stream):
+    """Read the column names from the first line of the given TSV stream,
+    leaving the stream at the first record.
+    """
+    return stream.readline().rstrip("\r\n").split("\t")
+
+
+def query_columns(query, columns):
+    """Return the given columns that the given pandas query refers to by name
+    or in backticks.
+
+    >>> query_columns("(date != '?') & (`qc.overallStatus` == 'good')", ["strain", "date", "qc.overallStatus", "qc"])
+    ['date', 'qc.overallStatus']
+    >>> query_columns("subclade != ''", ["clade", "subclade"])
+    ['subclade']
+    """
+    return [
+        column
+        for column in columns
+        if f"`{column}`" in query or re.search(rf"(?<![\w.`]){re.escape(column)}(?![\w.`])", query)
+    ]
+
+
+def date_bounds(dates):
+    """Return the earliest and latest possible dates of the given ISO 8601
+    dates with unknown months or days like 2024-XX-XX or 2024-03-XX, as augur
+    filter interprets ambiguous dates. Other dates have no bounds.
+
+    >>> earliest, latest = date_bounds(pd.Series(["2024-03-05", "2024-03-XX", "2024-XX-XX", "2024", "?", ""]))
+    >>> list(earliest)
+    ['2024-03-05', '2024-03-01', '2024-01-01', '2024-01-01', '', '']
+    >>> list(latest)
+    ['2024-03-05', '2024-03-31', '2024-12-31', '2024-12-31', '', '']
+    """
+    parts = dates.str.extract(r"^(\d{4})(?:-(\d{2}|XX))?(?:-(\d{2}|XX))?$")
+    year, month, day = parts[0], parts[1].fillna("XX"), parts[2].fillna("XX")
+    known_month = month != "XX"
+    known_day = known_month & (day != "XX")
+
+    earliest = year + "-" + month.where(known_month, "01") + "-" + day.where(known_day, "01")
+    month_end = pd.to_datetime(year + "-" + month.where(known_month, "12") + "-01", errors="coerce") + pd.offsets.MonthEnd(0)
+    latest = (year + "-" + month + "-" + day).where(known_day, month_end.dt.strftime("%Y-%m-%d"))
+
+    return earliest.fillna(""), latest.fillna("")
+
+
+if __name__ == '__main__':
+    profile_from_environment(__file__)
+    parser = argparse.ArgumentParser(__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--metadata", required=True,
+        help="Path to metadata TSV, optionally xz-compressed. Pipes are valid.")
+    parser.add_argument("--nextclade", required=True,
+        help="Path to Nextclade annotations TSV, optionally xz-compressed. Pipes are valid.")
+    parser.add_argument("--metadata-id-column", default="strain",
+        help="Column in the metadata with the strain name of each record.")
+    parser.add_argument("--nextclade-id-column", default="seqName",
+        help="Column in the Nextclade annotations with the strain name of each record.")
+    parser.add_argument("--query", required=True,
+        help="Pandas query that joined records must pass like the query of augur filter.")
+    parser.add_argument("--date-column", default="date",
+        help="Column with the date of each record.")
+    parser.add_argument("--min-date",
+        help="Earliest date of records to keep as YYYY-MM-DD or relative to today like '6M'.")
+    parser.add_argument("--max-date",
+        help="Latest date of records to keep as YYYY-MM-DD or relative to today like '0D'.")
+    parser.add_argument("--columns", nargs="+", required=True,
+        help="Columns to write for each record that passes. "
+             "The strain name is always written as the first column named by --metadata-id-column.")
+    parser.add_argument("--metadata-chunk-size", type=int, default=100000,
+        help="Maximum metadata records to read into memory at once.")
+    parser.add_argument("--output-metadata", required=True,
+        help="Path to output TSV of joined records that pass the query and date range.")
+
+    args = parser.parse_args()
+
+    today = pd.Timestamp.today().normalize()
+    min_date = parse_date_bound(args.min_date, today) if args.min_date else None
+    max_date = parse_date_bound(args.max_date, today) if args.max_date else None
+
+    metadata_stream = open_table(args.metadata)
+    nextclade_stream = open_table(args.nextclade)
+    metadata_header = read_header(metadata_stream)
+    nextclade_header = read_header(nextclade_stream)
+
+    # Only load columns that are written, queried, or filtered by date.
+    needed_columns = list(dict.fromkeys(
+        [args.date_column] + args.columns + query_columns(args.query, metadata_header + nextclade_header)
+    ))
+    needed_columns = [column for column in needed_columns if column != args.metadata_id_column]
+    missing_columns = set(needed_columns) - set(metadata_header) - set(nextclade_header)
+    if missing_columns:
+        print(f"ERROR: Columns missing from both the metadata and Nextclade annotations: {', '.join(sorted(missing_columns))}", file=sys.stderr)
+        sys.exit(1)
+
+    for header, id_column, name in ((metadata_header, args.metadata_id_column, "metadata"), (nextclade_header, args.nextclade_id_column, "Nextclade annotations")):
+        if id_column not in header:
+            print(f"ERROR: The {name} have no '{id_column}' column.", file=sys.stderr)
+            sys.exit(1)
+
+    metadata_columns = [column for column in needed_columns if column in metadata_header]
+    nextclade_columns = [column for column in needed_columns if column in nextclade_header]
+    shared_columns = [column for column in metadata_columns if column in nextclade_columns]
+
+    # Load the requested Nextclade columns of all records indexed by strain.
+    nextclade = pd.read_csv(
+        nextclade_stream,
+        sep="\t",
+        header=None,
+        names=nextclade_header,
+        usecols=[args.nextclade_id_column] + nextclade_columns,
+        dtype=str,
+        na_filter=False,
+    )
+    duplicates = nextclade[args.nextclade_id_column].duplicated()
+    if duplicates.any():
+        print(f"WARNING: Found duplicate Nextclade annotations for {duplicates.sum()} strains; using only the first annotation of each.", file=sys.stderr)
+        nextclade = nextclade[~duplicates]
+    nextclade = nextclade.set_index(args.nextclade_id_column)
+    print(f"Loaded Nextclade annotations for {len(nextclade)} strains.")
+
+    metadata_reader = pd.read_csv(
+        metadata_stream,
+        sep="\t",
+        header=None,
+        names=metadata_header,
+        usecols=[args.metadata_id_column] + metadata_columns,
+        dtype=str,
+        na_filter=False,
+        chunksize=args.metadata_chunk_size,
+    )
+
+    n_records = 0
+    n_passed = 0
+    seen_strains = set()
+    output_columns = [args.metadata_id_column] + [column for column in args.columns if column != args.metadata_id_column]
+    with open(args.output_metadata, "w", newline="") as output:
+        output.write("\t".join(output_columns) + "\n")
+
+        for metadata in metadata_reader:
+            n_records += len(metadata)
+
+            # Keep the first record of each strain like augur does
+            strains = metadata[args.metadata_id_column]
+            first = ~strains.duplicated() & ~strains.isin(seen_strains)
+            seen_strains.update(strains)
+            metadata = metadata[first]
+
+            # Join annotations of each record, preferring non-empty annotations
+            # over metadata values of the same column.
+            records = metadata.join(
+                nextclade,
+                on=args.metadata_id_column,
+                how="inner",
+                rsuffix=" (nextclade)",
+            )
+            for column in shared_columns:
+                annotation = records.pop(f"{column} (nextclade)")
+                records[column] = annotation.where(annotation != "", records[column])
+
+            try:
+                records = records.query(args.query)
+            except Exception as error:
+                print(f"ERROR: An error occurred when applying the query: {error}", file=sys.stderr)
+                sys.exit(1)
+
+            # Keep records whose possible dates overlap the date range
+            if min_date or max_date:
+                earliest, latest = date_bounds(records[args.date_column])
+                in_range = earliest != ""
+                if min_date:
+                    in_range &= latest >= min_date
+                if max_date:
+                    in_range &= earliest <= max_date
+                records = records[in_range]
+
+            n_passed += len(records)
+            records[output_columns].to_csv(output, sep="\t", index=False, header=False)
+
+    print(f"Wrote {n_passed} of {n_records} metadata records to {args.output_metadata}.")
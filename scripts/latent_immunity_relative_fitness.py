@@ -6,6 +6,7 @@ import jax.numpy as jnp
 import numpy as np
 import numpyro
 import numpyro.distributions as dist
+from jax import jit, lax, vmap
 from jax.nn import softmax
 from numpyro.distributions.distribution import TransformedDistribution
 from numpyro.distributions.transforms import OrderedTransform
@@ -75,13 +76,17 @@ class LatentSplineRW:
         self.basis_fn = basis_fn
 
     def build_model(self, data):
-        self.X = self.basis_fn.make_features(data)
+        # Keep basis as a contiguous (T, B) array on device, so it is not
+        # transposed or copied again each time the model is evaluated
+        self.X = jnp.asarray(
+            np.ascontiguousarray(self.basis_fn.make_features(data))
+        )
 
     def model_group(self, dim, N_groups):
         # Unpacking class properties
         X = self.X
 
-        _, num_knots = X.shape
+        N_time, num_knots = X.shape
         gam = numpyro.sample(
             "gam",
             dist.TransformedDistribution(
@@ -121,12 +126,13 @@ class LatentSplineRW:
                     )
                     phi_rw = jnp.cumsum(phi_rw_step, axis=1)
 
-        # Combine latent factor increments and starting position
-        phi_rw = jnp.vstack((jnp.zeros((1, dim - 1, N_groups)), phi_rw))
+        # Combine latent factor increments and starting position.
+        # The first knot and the last factor are fixed at zero, so only the
+        # remaining knots and factors enter a single (T, B) x (B, S * G) product.
+        phi_rw = jnp.tensordot(X[:, 1:], phi_rw, axes=1)
         phi_rw = jnp.concatenate(
-            (phi_rw, jnp.zeros((num_knots, 1, N_groups))), axis=1
+            (phi_rw, jnp.zeros((N_time, 1, N_groups))), axis=1
         )
-        phi_rw = jnp.einsum("bsg, tb -> tsg", phi_rw, X)
         phi = numpyro.deterministic(
             "phi", softmax(phi_0[None, :, :] + phi_rw, axis=1)
         )
@@ -184,6 +190,17 @@ class LatentHGSP:
         )
         return phi
 
+@partial(jit, static_argnums=2)
+@partial(vmap, in_axes=(0, 0, None))
+def _rollout_frequencies(init_logit, fitness, forecast_L):
+    def _step(logits, _):
+        logits = logits + fitness
+        return logits, softmax(logits, axis=0)
+
+    _, freq_forecast = lax.scan(_step, init_logit, None, length=forecast_L)
+    return freq_forecast
+
+
 def relative_fitness_dr_hier_numpyro(
     seq_counts, N, dim, phi_model, tau=None, pred=False, var_names=None
 ):
@@ -202,7 +219,7 @@ def relative_fitness_dr_hier_numpyro(
     phi = phi_model.model_group(dim, N_groups)
 
     # Compute fitness from weights and latent factors
-    fitness = jnp.einsum("tsg, sv -> tvg", phi, eta.T)
+    fitness = jnp.einsum("tsg, vs -> tvg", phi, eta)
     numpyro.deterministic("delta", fitness[:, :-1, :])
 
     # Sample initial frequency
@@ -216,9 +233,13 @@ def relative_fitness_dr_hier_numpyro(
                 ),
             )
 
-    # Sum fitness to get dynamics over time
+    # Sum fitness to get dynamics over time.
+    # Fitness is linear in the latent factors, so summing the (T, dim, G)
+    # latent factors before mapping them to variants gives the same logits
+    # as summing the (T, V, G) fitness excluding the first time point.
     init_logit = jnp.vstack((_init_logit, jnp.zeros((1, N_groups))))
-    logits = jnp.cumsum(fitness.at[0, :, :].set(0), axis=0) + init_logit
+    phi_sum = jnp.cumsum(phi, axis=0) - phi[0]
+    logits = jnp.einsum("tsg, vs -> tvg", phi_sum, eta) + init_logit
 
     # Evaluate likelihood
     obs = None if pred else np.swapaxes(np.nan_to_num(seq_counts), 1, 2)
@@ -329,6 +350,27 @@ class RelativeFitnessDR(ef.ModelSpec):
         self.phi_model.build_model(data)
         return None
 
+    def forecast_frequencies(self, samples, forecast_L):
+        """
+        Use posterior frequencies and relative fitness to forecast posterior frequencies.
+        Latent factors and therefore relative fitness are held at their last values,
+        so logits grow linearly over the forecast horizon as in the MLR model.
+        """
+        # Relative fitness at the last time point with the pivot last
+        delta = jnp.asarray(samples["delta"])[:, -1]
+        if self.hier:
+            fitness = jnp.concatenate((delta, jnp.zeros_like(delta[:, :1])), axis=1)
+        else:
+            fitness = delta  # Fitness includes the pivot already
+
+        # Roll logits forward from the last known frequency.
+        # Only the logits at the current step are kept while scanning over the horizon.
+        init_logit = jnp.log(jnp.asarray(samples["freq"])[:, -1])
+        samples["freq_forecast"] = _rollout_frequencies(
+            init_logit, fitness, forecast_L
+        )  # (S, forecast_L, V) or (S, forecast_L, V, G)
+        return samples
+
     def fit_mcmc(
         self,
         data: ef.VariantFrequencies,
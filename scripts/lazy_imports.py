@@ -0,0 +1,31 @@
+"""Defer imports of heavy modules until they are first used.
+
+Scripts import modules like evofr, JAX, or altair at the top as usual through
+`lazy_import`, but only pay for loading them on code paths that access them.
+Invocations that only print help or fail early on their arguments start fast.
+"""
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Return the module with the given name, deferring the execution of the
+    module until one of its attributes is first accessed.
+
+    >>> json = lazy_import("json")
+    >>> json.dumps([1])
+    '[1]'
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -1,6 +1,7 @@
 import argparse
 import json
 import csv
+from profiling import profile_from_environment
 
 def write_outfile(output_site, grouped_site):
     with open(output_site, "w") as outfile:
@@ -106,6 +107,7 @@ def parse_json(input_file, output_ga, output_rf, output_freq, output_raw, output
 
 
 if __name__ == "__main__":
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(description="Filter and parse MLR-model JSON data")
     parser.add_argument("--input", required=True, help="Path to the MLR output JSON file (<model>_results.json)")
     parser.add_argument("--outga", required=True, help="Path to filtered and parsed GA (growth advantage) TSV file (mlr/ga.tsv)")
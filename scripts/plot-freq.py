@@ -4,10 +4,14 @@ import json
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib as mpl
+import os
 import seaborn as sns
 import sys
 import matplotlib.ticker as mticker
 
+from sharded_plots import compose_panels, panel_filename, render_panels
+from profiling import profile_from_environment
+
 # Set global default fontsizes
 mpl.rcParams["legend.title_fontsize"] = 12
 mpl.rcParams["axes.labelsize"] = 12
@@ -16,7 +20,117 @@ mpl.rcParams["ytick.labelsize"] = 10
 mpl.rcParams["legend.fontsize"] = 10
 
 
-def plot_freq(df_file, raw_file, forecast_file, color_file, output_plot, cases_file=None, loc_lst=None, var_lst=None, auspice_config_file=None, coloring_field=None):
+def set_frequency_axis(ax):
+    """Set logit scale on the y-axis of the given axis and define ticks to
+    match forecasts-viz limits.
+    """
+    ax.set_yscale("logit")
+    ax.set_ylim(0.018, 0.99)
+    ax.set_yticks([0.01, 0.1, 0.5, 0.9, 0.99])
+    ax.set_yticklabels(["1%", "10%", "50%", "90%", "99%"])
+    ax.yaxis.set_minor_locator(mticker.NullLocator())
+
+
+def plot_location_freq(location, data, raw_data, location_cases, variants, color_by_variant, forecast_date, output_plot):
+    """Plot frequencies for a single location in the same style as one facet of
+    the combined plot and save it to the given output path.
+    """
+    fig, ax = plt.subplots(figsize=(4, 4))
+    ax.axvline(forecast_date, color="#000000", linestyle="dashed", zorder=-10)
+
+    for variant in variants:
+        variant_data = data[data["variant"] == variant].sort_values("date")
+        if variant_data.shape[0] == 0:
+            continue
+
+        color = color_by_variant[variant]
+        ax.plot(variant_data["date"], variant_data["median"], linewidth=2, color=color, label=variant)
+        ax.fill_between(variant_data["date"], variant_data["HDI_95_lower"], variant_data["HDI_95_upper"], alpha=0.4, color=color)
+
+        variant_raw = raw_data[raw_data["variant"] == variant]
+        ax.scatter(variant_raw["date"], variant_raw["raw_freq"], s=35, alpha=1.0, color=color)
+
+    if location_cases is not None:
+        ax2 = ax.twinx()
+        ax2.plot(
+            location_cases["date"],
+            location_cases["cases"],
+            color="#CCCCCC",
+            zorder=-100,
+            linestyle="--",
+            linewidth=1.5,
+        )
+        case_ticks = ax2.get_yticks()
+        ax2.set_yticks(
+            [case_ticks.max()],
+            labels=[str(int(case_ticks.max()))],
+        )
+
+    set_frequency_axis(ax)
+    ax.set_title(location)
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Frequency")
+    ax.tick_params(axis="x", rotation=45)
+    sns.despine(fig=fig)
+
+    fig.savefig(output_plot, bbox_inches="tight", dpi=300)
+    plt.close(fig)
+    return output_plot
+
+
+def plot_freq_legend(variants, color_by_variant, output_plot):
+    """Save the variant legend shared by all location panels as its own image.
+    """
+    fig = plt.figure(figsize=(2, 0.3 * len(variants) + 0.5))
+    handles = [
+        mpl.lines.Line2D([], [], color=color_by_variant[variant], marker="o", linewidth=2, label=variant)
+        for variant in variants
+    ]
+    fig.legend(handles=handles, title="Variant", loc="upper left", frameon=False)
+    fig.savefig(output_plot, bbox_inches="tight", dpi=300)
+    plt.close(fig)
+    return output_plot
+
+
+def plot_freq_panels(df, raw, cases, variants, color_by_variant, forecast_date, output_panels, output_plot=None, threads=1):
+    """Render one frequency plot per location in a pool of processes and,
+    optionally, compose the panels into a single plot.
+    """
+    os.makedirs(output_panels, exist_ok=True)
+
+    # Resolve colors for all variants up front, since a color map with a
+    # default factory cannot be sent to other processes.
+    color_by_variant = {variant: color_by_variant[variant] for variant in variants}
+
+    tasks = []
+    for location in sorted(df["location"].unique()):
+        location_cases = None
+        if cases is not None:
+            location_cases = cases[cases["location"] == location].sort_values("date")
+
+        tasks.append((
+            location,
+            df[df["location"] == location],
+            raw[raw["location"] == location],
+            location_cases,
+            variants,
+            color_by_variant,
+            forecast_date,
+            panel_filename(output_panels, location),
+        ))
+
+    panel_paths = render_panels(plot_location_freq, tasks, threads=threads)
+    legend_path = plot_freq_legend(
+        variants,
+        color_by_variant,
+        os.path.join(output_panels, "legend.png"),
+    )
+
+    if output_plot:
+        compose_panels(panel_paths, output_plot, columns=4, legend_path=legend_path)
+
+
+def plot_freq(df_file, raw_file, forecast_file, color_file, output_plot, cases_file=None, loc_lst=None, var_lst=None, auspice_config_file=None, coloring_field=None, output_panels=None, threads=1):
     retrospective = pd.read_csv(df_file, sep="\t", parse_dates=["date"])
     forecast = pd.read_csv(forecast_file, sep="\t", parse_dates=["date"])
     raw = pd.read_csv(raw_file, sep="\t", parse_dates=["date"])
@@ -85,6 +199,21 @@ def plot_freq(df_file, raw_file, forecast_file, color_file, output_plot, cases_f
     print(color_by_variant)
     df["variant_color"] = df["variant"].map(color_by_variant)
 
+    cases = None
+    if cases_file:
+        cases = pd.read_csv(
+            cases_file,
+            sep="\t",
+            parse_dates=["date"],
+        )
+        cases = cases[cases["date"] >= df["date"].min()].copy()
+
+    # Render each location as its own plot in parallel instead of a single
+    # facet grid.
+    if output_panels:
+        plot_freq_panels(df, raw, cases, variants, color_by_variant, forecast_date, output_panels, output_plot, threads)
+        return
+
     fig = sns.FacetGrid(
         data=df,
         col="location",
@@ -131,14 +260,7 @@ def plot_freq(df_file, raw_file, forecast_file, color_file, output_plot, cases_f
         markerscale=2.25,
     )
 
-    if cases_file:
-        cases = pd.read_csv(
-            cases_file,
-            sep="\t",
-            parse_dates=["date"],
-        )
-        cases = cases[cases["date"] >= df["date"].min()].copy()
-
+    if cases is not None:
         for (i, j, k), facet_df in fig.facet_data():
             if k == 0:
                 ax = fig.facet_axis(i, j)
@@ -184,6 +306,7 @@ def plot_freq(df_file, raw_file, forecast_file, color_file, output_plot, cases_f
     fig.savefig(output_plot, bbox_inches="tight", dpi=300)
 
 if __name__ == "__main__":
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(description="Plot Freq plots by location and variant.")
     parser.add_argument("-i", "--input_freq", type=str, required=True, help="Parsed MLR site freq TSV file (<model>_freq.tsv)")
     parser.add_argument("-r", "--input_raw", type=str, required=True, help="Path to weekly raw sequence TSV file")
@@ -194,6 +317,12 @@ if __name__ == "__main__":
     parser.add_argument("--coloring-field", default="subclade", help="name of the coloring field in the given Auspice config JSON to use for the color scale")
     parser.add_argument("-ll", "--location_list", required=False, help="Location list TXT file to include in frequency plot")
     parser.add_argument("-vl", "--variant_list", required=False, help="Variant list TXT file to include in frequency plot")
-    parser.add_argument("-o", "--output", type=str, required=True, help="Site frequency by location plot PDF")
+    parser.add_argument("-o", "--output", type=str, help="Site frequency by location plot PDF")
+    parser.add_argument("--output-panels", help="Directory to save one frequency plot per location to. When provided, locations get rendered in parallel and the plot in --output gets composed from these panels.")
+    parser.add_argument("--threads", type=int, default=1, help="Number of processes to use when rendering per-location panels")
     args = parser.parse_args()
-    plot_freq(args.input_freq, args.input_raw, args.input_forecast, args.colors, args.output, args.input_cases, args.location_list, args.variant_list, args.auspice_config, args.coloring_field)
+
+    if not args.output and not args.output_panels:
+        parser.error("At least one of --output or --output-panels is required.")
+
+    plot_freq(args.input_freq, args.input_raw, args.input_forecast, args.colors, args.output, args.input_cases, args.location_list, args.variant_list, args.auspice_config, args.coloring_field, args.output_panels, args.threads)
@@ -1,13 +1,115 @@
-import altair as alt
 import argparse
 from collections import defaultdict
 import json
 import math
-from matplotlib import pyplot as plt
 import numpy as np
+import os
 import pandas as pd
 
-def plot_ga(input_file, virus, color_file, out_var, out_loc, loc_lst, var_lst, pivot_file, auspice_config_file=None, coloring_field=None):
+from lazy_imports import lazy_import
+from sharded_plots import compose_panels, panel_filename, render_panels
+from profiling import profile_from_environment
+
+# Load altair only when charts get built
+alt = lazy_import("altair")
+
+
+def plot_ga_panel(df, title, x_title, y_field, y_sort, color_field, color_domain, color_range, tooltip_attributes, output):
+    """Plot growth advantages for a single location or variant in the same style
+    as one facet of the combined chart and save it to the given output path.
+    """
+    base_chart = alt.Chart(df)
+    color = alt.Color(
+        f"{color_field}:N",
+        scale=alt.Scale(domain=color_domain, range=color_range),
+        legend=None,
+    )
+
+    points = base_chart.mark_circle(size=35).encode(
+        x=alt.X("median:Q", title=x_title).scale(zero=False),
+        y=alt.Y(f"{y_field}:N", title=y_field.capitalize(), sort=y_sort),
+        color=color,
+        tooltip=tooltip_attributes,
+        )
+
+    error_bars = base_chart.mark_line().encode(
+        x=alt.X("HDI_95_lower:Q").scale(zero=False),
+        x2="HDI_95_upper:Q",
+        y=alt.Y(f"{y_field}:N", sort=y_sort),
+        color=color,
+        tooltip=tooltip_attributes
+        )
+
+    ga_threshold = base_chart.mark_rule(
+        strokeWidth=0.25,
+        strokeDash=[8, 8],
+        ).encode(
+            x=alt.datum(1.0),
+            color=alt.ColorValue("gray")
+            )
+
+    chart = (ga_threshold + points + error_bars).properties(
+        width=150,
+        height=150,
+        title=title,
+        )
+    chart.save(output, ppi=300)
+    return output
+
+
+def plot_ga_legend(field, title, color_domain, color_range, output):
+    """Save the color legend shared by all panels of a chart as its own image.
+    """
+    chart = alt.Chart(pd.DataFrame({field: color_domain})).mark_circle(size=35).encode(
+        color=alt.Color(f"{field}:N", scale=alt.Scale(domain=color_domain, range=color_range), title=title),
+        ).properties(
+            width=1,
+            height=1,
+        ).configure_view(
+            strokeWidth=0,
+        )
+    chart.save(output, ppi=300)
+    return output
+
+
+def plot_ga_panels(df, panel_field, panel_names, y_field, y_sort, x_title, color_field, color_by_field, tooltip_attributes, columns, output_panels, output_plot=None, title=None, threads=1):
+    """Render one growth advantage chart per value of the given panel field in a
+    pool of processes and, optionally, compose the panels into a single plot
+    with the given title.
+    """
+    os.makedirs(output_panels, exist_ok=True)
+    color_domain = list(color_by_field.keys())
+    color_range = list(color_by_field.values())
+
+    tasks = [
+        (
+            df[df[panel_field] == name],
+            name,
+            x_title,
+            y_field,
+            y_sort,
+            color_field,
+            color_domain,
+            color_range,
+            tooltip_attributes,
+            panel_filename(output_panels, name),
+        )
+        for name in panel_names
+    ]
+    panel_paths = render_panels(plot_ga_panel, tasks, threads=threads)
+    legend_path = plot_ga_legend(
+        color_field,
+        color_field.capitalize(),
+        color_domain,
+        color_range,
+        os.path.join(output_panels, "legend.png"),
+    )
+
+    if output_plot:
+        compose_panels(panel_paths, output_plot, columns=columns, legend_path=legend_path, title=title)
+
+
+def plot_ga(input_file, virus, color_file, out_var, out_loc, loc_lst, var_lst, pivot_file, auspice_config_file=None, coloring_field=None, output_panels=None, threads=1):
     # Read in GA file.
     df = pd.read_csv(input_file, sep="\t")
 
@@ -73,6 +175,46 @@ def plot_ga(input_file, virus, color_file, out_var, out_loc, loc_lst, var_lst, p
     max_col_loc = min(n_loc, 5)
     max_col_var = min(n_var, 4)
 
+    # Render each location and variant as its own chart in parallel instead of
+    # a single faceted chart.
+    if output_panels:
+        # Resolve colors for all variants up front, since a color map with a
+        # default factory cannot be sent to other processes.
+        color_by_variant = {variant: color_by_variant[variant] for variant in variants}
+
+        plot_ga_panels(
+            df,
+            panel_field="location",
+            panel_names=locations,
+            y_field="variant",
+            y_sort=locations,
+            x_title=f"growth advantage vs {pivot}",
+            color_field="variant",
+            color_by_field=color_by_variant,
+            tooltip_attributes=["variant", "HDI_95_lower", "median", "HDI_95_upper"],
+            columns=max_col_loc,
+            output_panels=os.path.join(output_panels, "by_location"),
+            output_plot=out_loc,
+            threads=threads,
+        )
+        plot_ga_panels(
+            df,
+            panel_field="variant",
+            panel_names=variants,
+            y_field="location",
+            y_sort=locations,
+            x_title="Growth advantage",
+            color_field="location",
+            color_by_field=color_by_location,
+            tooltip_attributes=["location", "HDI_95_lower", "median", "HDI_95_upper"],
+            columns=max_col_var,
+            output_panels=os.path.join(output_panels, "by_variant"),
+            output_plot=out_var,
+            title=f"{virus}: Variant (pivot {pivot})",
+            threads=threads,
+        )
+        return
+
     ### Plot GA by location
     tooltip_attributes = [
         "variant",
@@ -164,6 +306,7 @@ def plot_ga(input_file, virus, color_file, out_var, out_loc, loc_lst, var_lst, p
     variant_chart.save(out_var, ppi=300)
 
 if __name__ == "__main__":
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(description="Plot GA plots by location and variant.")
     parser.add_argument("-i", "--input_ga", type=str, help="Parsed MLR growth advantage file (<name>_ga.tsv)")
     parser.add_argument("-v", "--virus", help="Virus type ['H3N2', 'H1N1pdm', 'B_Vic']")
@@ -175,5 +318,7 @@ if __name__ == "__main__":
     parser.add_argument("-ll", "--location_list", required=False, help="Location list TXT file to include in GA plot")
     parser.add_argument("-vl", "--variant_list", required=False, help="Variant list TXT file to include in GA plot")
     parser.add_argument("-p", "--pivot", type=str, required=False, help="Pivot for MLR run")
+    parser.add_argument("--output-panels", help="Directory to save one GA plot per location (by_location/) and per variant (by_variant/) to. When provided, panels get rendered in parallel and the GA by location and variant plots get composed from these panels.")
+    parser.add_argument("--threads", type=int, default=1, help="Number of processes to use when rendering panels")
     args = parser.parse_args()
-    plot_ga(args.input_ga, args.virus, args.colors, args.out_variant, args.out_location, args.location_list, args.variant_list, args.pivot, args.auspice_config, args.coloring_field)
+    plot_ga(args.input_ga, args.virus, args.colors, args.out_variant, args.out_location, args.location_list, args.variant_list, args.pivot, args.auspice_config, args.coloring_field, args.output_panels, args.threads)
@@ -0,0 +1,112 @@
+"""Save and load posterior samples as binary arrays instead of JSON.
+
+Samples can be stored either as a single compressed ``.npz`` archive or as a
+directory with one ``.npy`` file per sample site. The directory layout can be
+loaded memory-mapped, so only the parts of each site that get used are read
+from disk.
+"""
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+POSTERIOR_FORMATS = ("json", "npz", "npy")
+
+
+def posterior_path(path, name, posterior_format):
+    """Return the path to store the posterior with the given name and format.
+
+    >>> posterior_path("results/models", "hierarchical", "json")
+    'results/models/hierarchical.json'
+    >>> posterior_path("results/models", "hierarchical", "npz")
+    'results/models/hierarchical.npz'
+    >>> posterior_path("results/models", "hierarchical", "npy")
+    'results/models/hierarchical'
+    """
+    if posterior_format == "npy":
+        return os.path.join(path, name)
+
+    return os.path.join(path, f"{name}.{posterior_format}")
+
+
+def save_samples(samples: dict, path: str, sites: Optional[Iterable[str]] = None, compress: bool = True):
+    """Save the given samples to a ``.npz`` archive or to a directory of ``.npy``
+    files, depending on whether the path ends with ``.npz``.
+
+    Parameters
+    ----------
+    samples:
+        dictionary of sample site names to arrays.
+
+    path:
+        path to the ``.npz`` archive or directory to save samples in.
+
+    sites:
+        optional names of sample sites to save. All sites are saved by default.
+        Requested sites missing from the samples are skipped.
+
+    compress:
+        whether to compress ``.npz`` archives.
+    """
+    if sites is None:
+        sites = list(samples.keys())
+
+    arrays = {
+        site: np.asarray(samples[site])
+        for site in sites
+        if site in samples
+    }
+
+    if path.endswith(".npz"):
+        if compress:
+            np.savez_compressed(path, **arrays)
+        else:
+            np.savez(path, **arrays)
+    else:
+        os.makedirs(path, exist_ok=True)
+        for site, array in arrays.items():
+            np.save(os.path.join(path, f"{site}.npy"), array)
+
+
+def load_samples(path: str, sites: Optional[Iterable[str]] = None, mmap: bool = True) -> dict:
+    """Load samples saved by `save_samples`.
+
+    Parameters
+    ----------
+    path:
+        path to the ``.npz`` archive or directory to load samples from.
+
+    sites:
+        optional names of sample sites to load. All sites are loaded by default.
+
+    mmap:
+        whether to memory-map sites from a directory of ``.npy`` files.
+        Compressed archives cannot be memory-mapped and are always read into
+        memory.
+
+    Returns
+    -------
+    dict
+        dictionary of sample site names to arrays.
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as archive:
+            available_sites = archive.files
+            if sites is not None:
+                available_sites = [site for site in available_sites if site in sites]
+
+            return {site: archive[site] for site in available_sites}
+
+    available_sites = sorted(
+        filename[:-len(".npy")]
+        for filename in os.listdir(path)
+        if filename.endswith(".npy")
+    )
+    if sites is not None:
+        available_sites = [site for site in available_sites if site in sites]
+
+    return {
+        site: np.load(os.path.join(path, f"{site}.npy"), mmap_mode="r" if mmap else None)
+        for site in available_sites
+    }
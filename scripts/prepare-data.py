@@ -8,6 +8,8 @@ import sys
 
 import re
 from datetime import datetime, timedelta
+from count_tensor import CountTensor
+from profiling import profile_from_environment
 
 SEQ_COUNTS_DTYPES = {
     'location': 'string',
@@ -73,6 +75,7 @@ def parse_relative_or_absolute_date(date_str: str) -> datetime:
             )
 
 if __name__ == '__main__':
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(__doc__,
         formatter_class=argparse.RawTextHelpFormatter)
 
@@ -148,6 +151,15 @@ if __name__ == '__main__':
         help="Path to output TSV file for the prepared variants data."
     )
 
+    parser.add_argument(
+        "--output-tensor-bundle",
+        help=(
+            "Optional path to output directory for the prepared variants data as a\n"
+            "count tensor bundle that run-model.py can memory-map instead of\n"
+            "parsing the TSV."
+        )
+    )
+
     args = parser.parse_args()
 
     # -------------------------------------------------------------------------
@@ -286,3 +298,6 @@ if __name__ == '__main__':
     seq_counts.sort_values(['location', 'variant', 'date']).to_csv(
         args.output_seq_counts, sep='\t', index=False
     )
+
+    if args.output_tensor_bundle:
+        CountTensor.from_seq_counts(seq_counts).save(args.output_tensor_bundle)
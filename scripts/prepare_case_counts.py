@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import argparse
 import pandas as pd
+from profiling import profile_from_environment
 
 
 if __name__ == '__main__':
+    profile_from_environment(__file__)
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--cases", required=True, help="CSV file of case counts from FluNet")
     parser.add_argument("--country-mapping", required=True, help="TSV file mapping FluNet country names (column 1) to Nextstrain country names (column 2)")
@@ -0,0 +1,148 @@
+"""Profile scripts on request without changing their code.
+
+Set `FORECASTS_FLU_PROFILE` to a directory to profile any script that calls
+`profile_from_environment` at the start of its main block. By default, a
+sampling profiler records the call stack of the main thread every few
+milliseconds of CPU time and writes the stacks in the collapsed format read by
+flamegraph.pl, speedscope, and inferno to `<script>-<pid>.folded`. Set
+`FORECASTS_FLU_PROFILER=deterministic` to record every function call with
+cProfile instead and write `<script>-<pid>.prof` for pstats, snakeviz, or
+flameprof.
+
+    FORECASTS_FLU_PROFILE=profiles python scripts/run-model.py --config ...
+    flamegraph.pl profiles/run-model-1234.folded > run-model.svg
+
+Scripts that run JAX code can also wrap hot sections in `jax_trace` to write
+JAX profiler traces for TensorBoard or XProf to the same directory.
+"""
+import atexit
+from collections import Counter
+from contextlib import nullcontext
+import os
+import signal
+import sys
+
+PROFILE_DIRECTORY_VARIABLE = "FORECASTS_FLU_PROFILE"
+PROFILER_VARIABLE = "FORECASTS_FLU_PROFILER"
+INTERVAL_VARIABLE = "FORECASTS_FLU_PROFILE_INTERVAL"
+DEFAULT_INTERVAL = 0.005
+
+
+def profile_directory():
+    """Return the directory to write profiles to or None when profiling is
+    disabled.
+    """
+    return os.environ.get(PROFILE_DIRECTORY_VARIABLE) or None
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        """Sample the call stack of the main thread at the given interval of
+        process CPU time in seconds.
+
+        Uses the SIGPROF interval timer, so only one sampling profiler can run
+        per process and only on platforms that support it.
+        """
+        self.interval = interval
+        self.stacks = Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def save(self, path):
+        """Save sampled stacks in collapsed format with one line per distinct
+        stack and the number of samples with that stack.
+        """
+        with open(path, "w") as fh:
+            for stack, count in self.stacks.most_common():
+                print(f"{stack} {count}", file=fh)
+
+
+class DeterministicProfiler:
+    def __init__(self):
+        """Record every function call with cProfile.
+        """
+        import cProfile
+
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+def profile_from_environment(script_path):
+    """Start profiling the rest of this process when `FORECASTS_FLU_PROFILE`
+    is set and write the profile for the given script when the process exits.
+
+    Returns the profiler or None when profiling is disabled.
+    """
+    directory = profile_directory()
+    if directory is None:
+        return None
+
+    os.makedirs(directory, exist_ok=True)
+    script_name = os.path.splitext(os.path.basename(script_path))[0]
+    profiler_name = os.environ.get(PROFILER_VARIABLE, "sampling")
+
+    if profiler_name == "sampling" and not hasattr(signal, "setitimer"):
+        print("WARNING: Sampling profiler is not supported on this platform; using the deterministic profiler.", file=sys.stderr)
+        profiler_name = "deterministic"
+
+    if profiler_name == "sampling":
+        profiler = SamplingProfiler(float(os.environ.get(INTERVAL_VARIABLE, DEFAULT_INTERVAL)))
+        path = os.path.join(directory, f"{script_name}-{os.getpid()}.folded")
+    elif profiler_name == "deterministic":
+        profiler = DeterministicProfiler()
+        path = os.path.join(directory, f"{script_name}-{os.getpid()}.prof")
+    else:
+        raise ValueError(f"Unknown profiler '{profiler_name}' in {PROFILER_VARIABLE}. Use 'sampling' or 'deterministic'.")
+
+    def stop_and_save():
+        profiler.stop()
+        profiler.save(path)
+        print(f"Profile saved at {path}", file=sys.stderr)
+
+    profiler.start()
+    atexit.register(stop_and_save)
+    return profiler
+
+
+def jax_trace(name):
+    """Return a context manager that writes a JAX profiler trace with the given
+    name to the profile directory when profiling is enabled.
+
+    Traces include the compilation and execution of each JAX operation and
+    open in TensorBoard's profile plugin or XProf. Writing the trace takes a
+    few seconds after the wrapped code finishes.
+    """
+    directory = profile_directory()
+    if directory is None:
+        return nullcontext()
+
+    import jax.profiler
+
+    return jax.profiler.trace(os.path.join(directory, "jax", f"{name}-{os.getpid()}"))
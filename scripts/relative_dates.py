@@ -0,0 +1,26 @@
+"""Parse date bounds the way augur filter does, without importing augur."""
+import re
+
+import pandas as pd
+
+
+def parse_date_bound(value, today):
+    """Parse an absolute date or a date relative to today like augur filter.
+
+    >>> today = pd.Timestamp("2026-10-18")
+    >>> parse_date_bound("2026-01-05", today)
+    '2026-01-05'
+    >>> parse_date_bound("6M", today)
+    '2026-04-18'
+    >>> parse_date_bound("0D", today)
+    '2026-10-18'
+    >>> parse_date_bound("2W", today)
+    '2026-10-04'
+    """
+    match = re.match(r"^(\d+)([DWMY])$", value.strip())
+    if match:
+        quantity = int(match.group(1))
+        unit = {"D": "days", "W": "weeks", "M": "months", "Y": "years"}[match.group(2)]
+        return (today - pd.DateOffset(**{unit: quantity})).strftime("%Y-%m-%d")
+
+    return pd.Timestamp(value).strftime("%Y-%m-%d")
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from functools import partial
 from typing import Optional
 
@@ -17,8 +18,16 @@ class HSGaussianProcess:
     Implementation of basis approximation to Gaussian processes.
     This produces basis functions for the Hilbert Space approximate Gaussian process.
     Reference: https://arxiv.org/abs/2004.11408
+
+    Basis features are cached by (L, num_basis, time points), so they are shared
+    between fitting, forecasting, and repeated fits within the same process.
+    Only the most recently used features are kept, so long-lived processes
+    fitting data of many lengths do not accumulate features.
     """
 
+    _feature_cache = OrderedDict()
+    _feature_cache_size = 8
+
     def __init__(self, L, num_basis):
         self.L = L
         self.num_basis = num_basis
@@ -36,18 +45,31 @@ class HSGaussianProcess:
 
     @staticmethod
     def phi_matrix(L: float, js: Array, x: Array):
-        phi_mapped = jit(
-            vmap(HSGaussianProcess.phi, in_axes=(None, 0, None), out_axes=-1)
-        )  # Map across m values
-        return phi_mapped(L, js, x)
+        return _phi_matrix(L, js, x)
 
     def make_features(self, ts) -> Array:
+        ts = np.asarray(ts)
+        key = (float(self.L), self.num_basis, ts.dtype.str, ts.shape, ts.tobytes())
+        cache = HSGaussianProcess._feature_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
         # Make eigenvectors
         ms = jnp.arange(1, self.num_basis + 1)
         phi = self.phi_matrix(self.L, ms, ts)
+        cache[key] = phi
+        if len(cache) > HSGaussianProcess._feature_cache_size:
+            cache.popitem(last=False)
         return phi
 
 
+# Compile the map across m values once rather than on every call
+_phi_matrix = jit(
+    vmap(HSGaussianProcess.phi, in_axes=(None, 0, None), out_axes=-1)
+)
+
+
 def assign_priors(name, val, default: dist.Distribution):
     if val is None:
         return numpyro.sample(name, default)
@@ -174,27 +196,41 @@ class SpectralMixture(HSGaussianProcess):
 def not_yet_observed(seq_counts):
     """
     Compute binary predictor for whether a variant has been seen by time t.
+    Works with both NumPy and JAX arrays of counts with shape (T, V).
+
+    >>> not_yet_observed(np.array([[0, 1], [0, 0], [2, 0], [0, 3]]))
+    array([[1, 1],
+           [1, 1],
+           [0, 1],
+           [0, 0]])
     """
-    T, V = seq_counts.shape
-    never_seen = np.ones_like(seq_counts)
-    for v in range(V):
-        for t in range(1, T):
-            # If we haven't seen yet, check that we still havent
-            if never_seen[t - 1, v]:
-                never_seen[t, v] = seq_counts[t, v] == 0
-            # If we have seen it, we know it's 0
-            else:
-                never_seen[t, v] = 0
-    return never_seen
+    xp = jnp if isinstance(seq_counts, jax.Array) else np
+
+    # A variant stays unseen until the first time after the first time point
+    # that it has non-zero (or missing) counts.
+    seen = xp.cumsum(seq_counts[1:] != 0, axis=0) > 0
+    never_seen = xp.concatenate(
+        (xp.ones_like(seq_counts[:1], dtype=bool), ~seen), axis=0
+    )
+    return never_seen.astype(seq_counts.dtype)
 
 
 def relative_fitness_hsgp_numpyro(
-    seq_counts, N, hsgp, tau=None, pred=False, var_names=None
+    seq_counts,
+    N,
+    hsgp,
+    tau=None,
+    pred=False,
+    var_names=None,
+    never_seen=None,
+    hsgp_features=None,
 ):
     N_time, N_variants = seq_counts.shape
 
     # Generate features matrix
-    phi = hsgp.make_features(np.arange(N_time))
+    phi = hsgp_features
+    if phi is None:
+        phi = hsgp.make_features(np.arange(N_time))
     num_basis = phi.shape[-1]
 
     # Sample HSGP parameters
@@ -216,7 +252,8 @@ def relative_fitness_hsgp_numpyro(
     logits = jnp.cumsum(fitness.at[0, :].set(0), axis=0) + init_logit
 
     # Adjust for introductions
-    never_seen = not_yet_observed(seq_counts)
+    if never_seen is None:
+        never_seen = not_yet_observed(seq_counts)
     logits = logits - 10 * never_seen
 
     # Evaluate likelihood
@@ -250,6 +287,12 @@ class RelativeFitnessHSGP(ef.ModelSpec):
         )
 
     def augment_data(self, data: dict) -> None:
+        # Indicators of introductions only depend on the data, so compute them
+        # once instead of on every model evaluation
+        data["never_seen"] = not_yet_observed(data["seq_counts"])
+        data["hsgp_features"] = self.hsgp.make_features(
+            np.arange(data["seq_counts"].shape[0])
+        )
         return None
 
     def fit_mcmc(
@@ -3,20 +3,31 @@
 
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import numpy as np
-import pandas as pd
 import os
+import sys
+import traceback
 import yaml
-import evofr as ef
 from datetime import date
-import hier_frequencies
-import hier_mlr
-
-from hier_frequencies import HierFrequencies
-from hier_mlr import HierMLR
-
-from latent_immunity_relative_fitness import RelativeFitnessDR
-from latent_immunity_relative_fitness import LatentSplineRW
+import posterior_store
+from lazy_imports import lazy_import
+from stage_timer import StageTimer
+from profiling import jax_trace, profile_from_environment
+
+# Load data and modelling libraries and models on first use, so invocations
+# that do not fit or export models start without importing pandas, JAX,
+# numpyro, and evofr.
+pd = lazy_import("pandas")
+jax = lazy_import("jax")
+numpyro = lazy_import("numpyro")
+ef = lazy_import("evofr")
+backtest = lazy_import("backtest")
+count_tensor = lazy_import("count_tensor")
+hier_frequencies = lazy_import("hier_frequencies")
+hier_mlr = lazy_import("hier_mlr")
+latent_immunity_relative_fitness = lazy_import("latent_immunity_relative_fitness")
 
 def parse_with_default(cf, var, dflt):
     if var in cf:
@@ -35,31 +46,107 @@ def parse_pool_scale(cf_m):
     return pool_scale
 
 class NUTS_from_MAP:
-    def __init__(self, num_warmup, num_samples, iters, lr):
+    def __init__(self, num_warmup, num_samples, iters, lr, num_chains=1):
         self.num_warmup = num_warmup
         self.num_samples = num_samples
+        self.num_chains = num_chains
         self.iters = iters
         self.lr = lr
 
-    def fit(self, model, data, name=None):
-        init_strat, _ = ef.init_to_MAP(model, data, iters=self.iters, lr=self.lr)
+    def fit(self, model, data, name=None, timer=None, init_values=None):
+        timer = timer if timer is not None else StageTimer()
+
+        # Start from the given values instead of the MAP estimate if any
+        if init_values is not None:
+            init_strat = numpyro.infer.init_to_value(values=init_values)
+        else:
+            with timer.stage("map_init", model=name):
+                init_strat, _ = ef.init_to_MAP(model, data, iters=self.iters, lr=self.lr)
+
+        # Run warmup and sampling separately to time them, but otherwise fit
+        # the same way as evofr's InferNUTS.
         inference_method = ef.InferNUTS(
             num_warmup=self.num_warmup,
             num_samples=self.num_samples,
             init_strategy=init_strat,
             dense_mass=True,
         )
-        return inference_method.fit(model, data, name=name)
+        handler = inference_method.handler
+        input = data.make_data_dict()
+        model.augment_data(input)
+        mcmc = numpyro.infer.MCMC(
+            handler.kernel(model.model_fn, **handler.kernel_kwargs),
+            num_warmup=self.num_warmup,
+            num_samples=self.num_samples,
+            num_chains=self.num_chains,
+        )
 
+        with timer.stage("nuts_warmup", model=name):
+            mcmc.warmup(handler.rng_key, **input)
+            jax.block_until_ready(mcmc.post_warmup_state)
 
-def parse_inference_method(method_name, lr, iters, num_warmup, num_samples):
+        with timer.stage("nuts_sampling", model=name):
+            mcmc.run(mcmc.post_warmup_state.rng_key, **input)
+            handler.mcmc = mcmc
+            handler.samples = jax.block_until_ready(mcmc.get_samples())
+
+        with timer.stage("posterior_predictive", model=name):
+            samples = jax.block_until_ready(handler.predict(model.model_fn, input))
+
+        return ef.PosteriorHandler(
+            samples=samples, data=data, name=name if name is not None else ""
+        )
+
+
+def fit_svi_from_values(inference_method, model, data, name, init_values, iters=None):
+    """
+    Fit the model with the given SVI inference method starting from the given
+    values of its latent sites, optionally with fewer optimization steps.
+    """
+    input = data.make_data_dict()
+    model.augment_data(input)
+
+    guide = inference_method.guide_fn(
+        model.model_fn, init_loc_fn=numpyro.infer.init_to_value(values=init_values)
+    )
+    handler = inference_method.handler
+    handler.fit(model.model_fn, guide, input, iters or inference_method.iters)
+    samples = handler.predict(
+        model.model_fn, guide, input, num_samples=inference_method.num_samples
+    )
+    samples["losses"] = handler.losses
+
+    return ef.PosteriorHandler(samples=samples, data=data, name=name)
+
+
+def fit_model(inference_method, model, data, name, timer, init_values=None, warm_start_iters=None):
+    """
+    Fit the model with the given inference method and time the stages of fitting.
+    When profiling is enabled, also write a JAX profiler trace of the fit.
+
+    Fits start from the given initial values of latent sites if any, such as
+    the posterior of a previous fit to similar data. SVI methods then run the
+    given number of warm start iterations instead of their usual number.
+    """
+    with jax_trace(f"fit-{name}"):
+        if isinstance(inference_method, NUTS_from_MAP):
+            return inference_method.fit(model, data, name=name, timer=timer, init_values=init_values)
+
+        with timer.stage("fit", model=name):
+            if init_values is not None:
+                return fit_svi_from_values(inference_method, model, data, name, init_values, warm_start_iters)
+
+            return inference_method.fit(model, data, name=name)
+
+
+def parse_inference_method(method_name, lr, iters, num_warmup, num_samples, num_chains=1):
     if method_name == "FullRank":
         method = ef.InferFullRank(lr=lr, iters=iters, num_samples=num_samples)
     elif method_name == "MAP":
         method = ef.InferMAP(lr=lr, iters=iters)
     elif method_name == "NUTS":
         method = NUTS_from_MAP(
-            num_warmup=num_warmup, num_samples=num_samples, iters=iters, lr=lr
+            num_warmup=num_warmup, num_samples=num_samples, iters=iters, lr=lr, num_chains=num_chains
         )
     else:  # Default is full rank
         method = ef.InferFullRank(lr=lr, iters=iters, num_samples=num_samples)
@@ -79,9 +166,12 @@ class ModelConfig:
     def load_data(self, override_seq_path=None):
         data_cf = self.config["data"]
 
-        # Load sequence count data
+        # Load sequence count data, memory-mapping count tensor bundles
+        # written by prepare-data.py instead of parsing a table.
         seq_path = override_seq_path or data_cf["seq_path"]
-        if seq_path.endswith(".tsv"):
+        if count_tensor.is_count_tensor(seq_path):
+            raw_seq = count_tensor.CountTensor.load(seq_path)
+        elif seq_path.endswith(".tsv"):
             raw_seq = pd.read_csv(seq_path, sep="\t")
         else:
             raw_seq = pd.read_csv(seq_path)
@@ -89,12 +179,29 @@ class ModelConfig:
         # Load locations
         if "locations" in data_cf:
             locations = data_cf["locations"]
+        elif isinstance(raw_seq, count_tensor.CountTensor):
+            locations = raw_seq.locations
         else:
             # Check if raw_seq has location column
             locations = pd.unique(raw_seq["location"])
 
         return raw_seq, locations
 
+    def load_pivot(self, override_pivot=None):
+        # Use mlr config pivot unless a dataset-specific pivot is specified
+        pivot = None
+        if self.config["model"]["pivot"]:
+            pivot = self.config["model"]["pivot"]
+        if override_pivot and override_pivot != "None":
+            pivot = override_pivot
+        return pivot
+
+    def load_aggregation_frequency(self):
+        aggregation_frequency = None
+        if self.config["data"]["aggregation_frequency"]:
+            aggregation_frequency = self.config["data"]["aggregation_frequency"]
+        return aggregation_frequency
+
     def load_model(self, override_hier=None):
         model_cf = self.config["model"]
 
@@ -127,6 +234,9 @@ class ModelConfig:
                 xi_by_group = parse_with_default(model_cf, "xi_by_group", dflt=False)
                 left_buffer = parse_with_default(model_cf, "left_buffer", dflt=0)
                 right_buffer = parse_with_default(model_cf, "right_buffer", dflt=0)
+                deterministic_sites = parse_with_default(model_cf, "deterministic_sites", dflt=None)
+                sparse_likelihood = parse_with_default(model_cf, "sparse_likelihood", dflt=False)
+                sufficient_statistics = parse_with_default(model_cf, "sufficient_statistics", dflt=False)
                 model = hier_mlr.HierMLR(
                     tau=tau,
                     pool_scale=ps,
@@ -136,14 +246,17 @@ class ModelConfig:
                     right_buffer=right_buffer,
                     windowed=windowed,
                     simple_exclusion=simple_exclusion,
+                    deterministic_sites=deterministic_sites,
+                    sparse_likelihood=sparse_likelihood,
+                    sufficient_statistics=sufficient_statistics,
                 )
             elif version == "Latent":
                 print("Running hier Latent model")
                 order = parse_with_default(model_cf, "order", dflt=6)
                 k = parse_with_default(model_cf, "k", dflt=4)
-                phi_model = LatentSplineRW(ef.Spline(order=order, k=k))
+                phi_model = latent_immunity_relative_fitness.LatentSplineRW(ef.Spline(order=order, k=k))
                 latent_dim = parse_with_default(model_cf, "latent_dim", dflt=4)
-                model = RelativeFitnessDR(dim=latent_dim, phi_model=phi_model, tau=tau, hier=True)
+                model = latent_immunity_relative_fitness.RelativeFitnessDR(dim=latent_dim, phi_model=phi_model, tau=tau, hier=True)
         else:
             if version == "MLR":
                 print("Running MLR model")
@@ -152,9 +265,9 @@ class ModelConfig:
                 model = ef.MultinomialLogisticRegression(tau=tau)
             elif version == "Latent":
                 print("Running Latent model")
-                phi_model = LatentSplineRW(ef.Spline(order=order, k=k))
+                phi_model = latent_immunity_relative_fitness.LatentSplineRW(ef.Spline(order=order, k=k))
                 latent_dim = parse_with_default(model_cf, "latent_dim", dflt=4)
-                model = RelativeFitnessDR(dim=latent_dim, hier=False)
+                model = latent_immunity_relative_fitness.RelativeFitnessDR(dim=latent_dim, hier=False)
 
         model.forecast_L = forecast_L
 
@@ -168,10 +281,11 @@ class ModelConfig:
         num_samples = int(
             parse_with_default(infer_cf, "num_samples", dflt=1500)
         )
+        num_chains = int(parse_with_default(infer_cf, "num_chains", dflt=1))
 
         method_name = parse_with_default(infer_cf, "method", dflt="FullRank")
         inference_method = parse_inference_method(
-            method_name, lr, iters, num_warmup, num_samples
+            method_name, lr, iters, num_warmup, num_samples, num_chains
         )
         return inference_method
 
@@ -188,26 +302,87 @@ class ModelConfig:
         )
         return fit, save, load, export_json, export_path
 
+    def load_posterior_settings(self):
+        settings_cf = self.config["settings"]
+        posterior_format = parse_with_default(
+            settings_cf, "posterior_format", dflt="json"
+        )
+        if posterior_format not in posterior_store.POSTERIOR_FORMATS:
+            raise Exception(f"The posterior format '{posterior_format}' is not supported. Choose one of {posterior_store.POSTERIOR_FORMATS}.")
+
+        posterior_sites = parse_with_default(
+            settings_cf, "posterior_sites", dflt=None
+        )
+        return posterior_format, posterior_sites
+
+
+def save_posterior(posterior, path, name, posterior_format="json", posterior_sites=None):
+    """Save samples from the given posterior to the models directory of the
+    given path as JSON or as binary arrays, optionally keeping only the
+    requested sample sites.
+    """
+    model_path = posterior_store.posterior_path(f"{path}/models", name, posterior_format)
+    if posterior_format == "json":
+        if posterior_sites is not None:
+            posterior = ef.PosteriorHandler(
+                samples={site: posterior.samples[site] for site in posterior_sites if site in posterior.samples},
+                data=posterior.data,
+                name=name,
+            )
+        posterior.save_posterior(model_path)
+    else:
+        posterior_store.save_samples(posterior.samples, model_path, sites=posterior_sites)
+
+
+def load_posterior(data, path, name, posterior_format="json", posterior_sites=None):
+    """Load samples saved by `save_posterior` into a new posterior for the given
+    data.
+    """
+    model_path = posterior_store.posterior_path(f"{path}/models", name, posterior_format)
+    if posterior_format == "json":
+        posterior = ef.PosteriorHandler(data=data, name=name)
+        posterior.load_posterior(model_path)
+    else:
+        posterior = ef.PosteriorHandler(
+            samples=posterior_store.load_samples(model_path, sites=posterior_sites),
+            data=data,
+            name=name,
+        )
+
+    return posterior
 
-def fit_models(rs, locations, model, inference_method, hier, path, save, pivot=None, max_date=None, aggregation_frequency=None):
+
+def fit_models(rs, locations, model, inference_method, hier, path, save, pivot=None, max_date=None, aggregation_frequency=None, posterior_format="json", posterior_sites=None, timer=None):
     multi_posterior = ef.MultiPosterior()
+    timer = timer if timer is not None else StageTimer()
 
     if hier:
         # Subset data to locations of interest
-        raw_seq = rs[rs.location.isin(locations)]
-        data = hier_frequencies.HierFrequencies(raw_seq=raw_seq, pivot=pivot, group="location", max_date=max_date, aggregation_frequency=aggregation_frequency)
+        with timer.stage("construct_data", model="hierarchical"):
+            if isinstance(rs, count_tensor.CountTensor):
+                data = hier_frequencies.HierFrequencies.from_count_tensor(rs.subset_locations(locations), pivot=pivot, max_date=max_date, aggregation_frequency=aggregation_frequency)
+            else:
+                raw_seq = rs[rs.location.isin(locations)]
+                data = hier_frequencies.HierFrequencies(raw_seq=raw_seq, pivot=pivot, group="location", max_date=max_date, aggregation_frequency=aggregation_frequency)
 
         # Fit model
-        posterior = inference_method.fit(model, data, name="hierarchical")
+        posterior = fit_model(inference_method, model, data, "hierarchical", timer)
 
         # Forecast frequencies
-        model.forecast_frequencies(posterior.samples, forecast_L=model.forecast_L)
+        with timer.stage("forecast", model="hierarchical"):
+            model.forecast_frequencies(posterior.samples, forecast_L=model.forecast_L)
+            jax.block_until_ready(posterior.samples)
 
         multi_posterior.add_posterior(posterior=posterior)
 
         if save:
-            posterior.save_posterior(f"{path}/models/hierarchical.json")
+            with timer.stage("save_posterior", model="hierarchical"):
+                save_posterior(posterior, path, "hierarchical", posterior_format, posterior_sites)
+                data.save(f"{path}/models/hierarchical_data.npz")
     else:
+        if isinstance(rs, count_tensor.CountTensor):
+            rs = rs.to_seq_counts()
+
         for location in locations:
             # Subset to data of interest
             raw_seq = rs[rs.location == location].copy()
@@ -217,35 +392,49 @@ def fit_models(rs, locations, model, inference_method, hier, path, save, pivot=N
                 print(f"Location {location} not in data")
                 continue
 
-            data = ef.VariantFrequencies(raw_seq=raw_seq, pivot=pivot)
+            with timer.stage("construct_data", model=location):
+                data = ef.VariantFrequencies(raw_seq=raw_seq, pivot=pivot)
 
             # Fit model
-            posterior = inference_method.fit(model, data, name=location)
+            posterior = fit_model(inference_method, model, data, location, timer)
 
             # Forecast frequencies
-            model.forecast_frequencies(posterior.samples, forecast_L=model.forecast_L)
+            with timer.stage("forecast", model=location):
+                model.forecast_frequencies(posterior.samples, forecast_L=model.forecast_L)
+                jax.block_until_ready(posterior.samples)
 
             # Add posterior to group
             multi_posterior.add_posterior(posterior=posterior)
 
             # if save, save
             if save:
-                posterior.save_posterior(f"{path}/models/{location}.json")
+                with timer.stage("save_posterior", model=location):
+                    save_posterior(posterior, path, location, posterior_format, posterior_sites)
 
     return multi_posterior
 
 
-def load_models(rs, locations, model, path=None):
+def load_models(rs, locations, model, path=None, posterior_format="json", posterior_sites=None, hier=False):
     multi_posterior = ef.MultiPosterior()
 
+    if hier:
+        # Restore the aggregated counts and their axes saved with the fit
+        # instead of rebuilding them from the sequence counts.
+        data = hier_frequencies.HierFrequencies.load(f"{path}/models/hierarchical_data.npz")
+        posterior = load_posterior(data, path, "hierarchical", posterior_format, posterior_sites)
+        multi_posterior.add_posterior(posterior=posterior)
+        return multi_posterior
+
+    if isinstance(rs, count_tensor.CountTensor):
+        rs = rs.to_seq_counts()
+
     for location in locations:
         # Subset to data of interest
         raw_seq = rs[rs.location == location].copy()
         data = ef.VariantFrequencies(raw_seq=raw_seq)
 
         # Load samples
-        posterior = ef.PosteriorHandler(data=data, name=location)
-        posterior.load_posterior(f"{path}/models/{location}.json")
+        posterior = load_posterior(data, path, location, posterior_format, posterior_sites)
 
         # Add posterior to group
         multi_posterior.add_posterior(posterior=posterior)
@@ -333,7 +522,7 @@ def make_raw_freq_tidy(data, location):
     return {"metadata": metadata, "data": entries}
 
 # export results MLR model (with GA)
-def export_results_mlr(multi_posterior, ps, path, data_name, hier, ga_inclusion_threshold, variant_location_counts, ps_point_estimator):
+def export_results_mlr(multi_posterior, ps, path, data_name, hier, ga_inclusion_threshold, variant_location_counts, ps_point_estimator, model=None):
     EXPORT_SITES = ["freq", "ga", "freq_forecast"]
     EXPORT_DATED = [True, False, True]
     EXPORT_FORECASTS = [False, False, True]
@@ -344,16 +533,22 @@ def export_results_mlr(multi_posterior, ps, path, data_name, hier, ga_inclusion_
 
     # Split hierarchical results into group posteriors
     if hier:
+        mp = multi_posterior
+        hier_posterior = mp.locator["hierarchical"]
+        hier_samples = hier_posterior.samples
+        hier_data = hier_posterior.data
+
+        # Compute sites that were not recorded during sampling for one group
+        # at a time from posterior beta.
         def get_group_samples(samples, sites, group):
             samples_group = dict()
             for site in sites:
-                samples_group[site] = samples[site][..., group]
+                if site in samples:
+                    samples_group[site] = samples[site][..., group]
+                else:
+                    samples_group[site] = model.compute_site(samples, hier_data.seq_counts, site, group)
             return samples_group
 
-        mp = multi_posterior
-        hier_posterior = mp.locator["hierarchical"]
-        hier_samples = hier_posterior.samples
-        hier_data = hier_posterior.data
         multi_posterior = ef.MultiPosterior()
         for n, name in enumerate(hier_data.names):
             hier_data.groups[n].dates = hier_data.dates
@@ -364,9 +559,14 @@ def export_results_mlr(multi_posterior, ps, path, data_name, hier, ga_inclusion_
                     name=name)
             )
         # Add final posterior for hierarchical growth advantages
+        if "ga_loc" in hier_samples:
+            ga_loc = hier_samples["ga_loc"]
+        else:
+            ga_loc = model.compute_site(hier_samples, hier_data.seq_counts, "ga_loc")
+
         multi_posterior.add_posterior(
             ef.PosteriorHandler(
-                samples={"ga": hier_samples["ga_loc"]},
+                samples={"ga": ga_loc},
                 data=hier_data,
                 name="hierarchical")
         )
@@ -431,9 +631,9 @@ def export_results_mlr(multi_posterior, ps, path, data_name, hier, ga_inclusion_
 # Export results Latent model (without GA)
 # Eventually add relative fitness (RF) where we have GA for MLR
 def export_results_latent(multi_posterior, ps, path, data_name, hier):
-    EXPORT_SITES = ["freq", "delta", "ga"]
-    EXPORT_DATED = [True, True, True]
-    EXPORT_FORECASTS = [False, False, False]
+    EXPORT_SITES = ["freq", "delta", "ga", "freq_forecast"]
+    EXPORT_DATED = [True, True, True, True]
+    EXPORT_FORECASTS = [False, False, False, True]
     EXPORT_ATTRS = ["pivot"]
 
     # Make directories
@@ -509,60 +709,140 @@ def nonnegative_int(value):
         raise argparse.ArgumentTypeError(f"{int_value} is not a positive integer.")
     return int_value
 
-if __name__ == "__main__":
+def parse_bool(value):
+    """
+    Parse boolean values from manifest columns.
+    """
+    return str(value).strip().lower() in ("true", "yes", "1")
 
-    parser = argparse.ArgumentParser(
-        description="Estimating variant growth rates."
-    )
-    parser.add_argument("--config", help="path to config file")
-    parser.add_argument(
-        "--seq-path",
-        help="File path to sequence data. Overrides data.seq_path in config.",
-    )
-    parser.add_argument(
-        "--export-path",
-        help="Path to export directory. Overrides settings.export_path in config.",
-    )
-    parser.add_argument(
-        "--data-name",
-        help="Name of the data set to include in the results filename as <data_name>_results.json. "
-        + "Overrides data.name in config.",
-    )
-    parser.add_argument(
-        "--pivot",
-        help="Variant to use as pivot. Overrides model.pivot in config.",
-    )
 
-    parser.add_argument(
-        "--hier",  action='store_true', default=False,
-        help="Whether to run the model as hierarchical. Overrides model.hierarchical in config. "
-        + "Default is false if unspecified."
-    )
+# Columns of a manifest for batch runs and functions to parse their values
+MANIFEST_COLUMNS = {
+    "config": str,
+    "seq_path": str,
+    "export_path": str,
+    "data_name": str,
+    "pivot": str,
+    "max_date": str,
+    "hier": parse_bool,
+    "location_ga_inclusion_threshold": nonnegative_int,
+    "export_only": parse_bool,
+}
 
-    parser.add_argument(
-        "--max-date",
-        help="Latest date in ISO 8601 format (YYYY-MM-DD) or backward-looking relative date in ISO 8601 duration (e.g., '14D' or 'P14D') for observed frequency estimation. Any aggregation frequency operates backward in time from this date. If this date isn't provided, the latest date from the given sequence counts data will be used.",
-    )
 
-    parser.add_argument(
-        "--location-ga-inclusion-threshold", type=nonnegative_int, default=0,
-        help="Mininum number of sequences that need to be observed for a specific "
-        + "location x variant combination. Default is 0, ie including all combinations "
-        + "even if there isn't data for a particular combination."
-    )
+def read_manifest(path, defaults):
+    """
+    Read a tab-delimited manifest with one model run per row and return the
+    arguments for each run. Empty or missing columns fall back to the given
+    default arguments.
+    """
+    manifest = pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False)
 
-    args = parser.parse_args()
+    unknown_columns = set(manifest.columns) - set(MANIFEST_COLUMNS)
+    if unknown_columns:
+        raise ValueError(f"Unknown columns in manifest {path}: {', '.join(sorted(unknown_columns))}")
+    if "config" not in manifest.columns:
+        raise ValueError(f"Manifest {path} is missing the required 'config' column.")
+
+    runs = []
+    for row in manifest.to_dict("records"):
+        run_args = vars(defaults).copy()
+        for column, value in row.items():
+            if value != "":
+                run_args[column] = MANIFEST_COLUMNS[column](value)
+        runs.append(argparse.Namespace(**run_args))
+
+    return runs
+
+
+def limit_jax_resources(threads=None, device_count=None):
+    """
+    Limit the number of threads that JAX uses to run compiled models on the CPU
+    and split the CPU into the given number of JAX devices, so NUTS chains can
+    run in parallel on separate devices. Both limits are passed to JAX through
+    environment variables, so they must be set before the first use of JAX and
+    also apply to worker processes started afterwards.
+    """
+    # XLA sizes its CPU thread pools by NPROC when set instead of by the
+    # number of available cores.
+    if threads:
+        os.environ["NPROC"] = str(threads)
+    if device_count:
+        os.environ["JAX_NUM_CPU_DEVICES"] = str(device_count)
+
+
+def enable_compilation_cache(path):
+    """
+    Store compiled XLA executables in the given directory, so runs in the same
+    or later processes reuse them whenever the compiled programs agree.
+    """
+    import jax
+
+    jax.config.update("jax_compilation_cache_dir", path)
+
+
+def run_manifest(runs, jobs=1, compilation_cache=None):
+    """
+    Run all models described by the given run arguments in this process or,
+    with more than one job, in a pool of worker processes that each handle
+    several runs. Failed runs do not stop the remaining runs.
+
+    Returns the number of failed runs.
+    """
+    failed = 0
+    if jobs <= 1:
+        for run_args in runs:
+            print(f"Running model for config {run_args.config}")
+            try:
+                run_model(run_args)
+            except Exception:
+                traceback.print_exc()
+                failed += 1
+        return failed
+
+    # NumPyro tracks effect handlers in global state, so models cannot be
+    # traced concurrently from threads. Use separate worker processes instead
+    # that start fresh rather than forking an initialized JAX runtime.
+    initializer = enable_compilation_cache if compilation_cache else None
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=(compilation_cache,) if compilation_cache else (),
+    ) as executor:
+        futures = {executor.submit(run_model, run_args): run_args for run_args in runs}
+        for future, run_args in futures.items():
+            try:
+                future.result()
+            except Exception:
+                print(f"Model run for config {run_args.config} failed.")
+                traceback.print_exc()
+                failed += 1
+
+    return failed
+
+
+def run_model(args):
+    """
+    Fit or load, and export the models for the given command line arguments.
+    """
+    # Time each stage of the run
+    timer = StageTimer()
 
     # Load configuration, data, and create model
     config = ModelConfig(args.config)
     print(f"Config loaded: {config.path}")
 
     # Load sequence data for evofr
-    raw_seq, locations = config.load_data(args.seq_path)
+    with timer.stage("load_data"):
+        raw_seq, locations = config.load_data(args.seq_path)
     print("Data loaded sucessfuly")
 
     # Calculate variant x location sequence counts
-    variant_location_counts = raw_seq.groupby(["location", "variant"])["sequences"].sum().to_dict()
+    if isinstance(raw_seq, count_tensor.CountTensor):
+        variant_location_counts = raw_seq.sequences_by_location_and_variant()
+    else:
+        variant_location_counts = raw_seq.groupby(["location", "variant"])["sequences"].sum().to_dict()
     print("variant_location_counts:", variant_location_counts)
 
     override_hier = None
@@ -578,6 +858,9 @@ if __name__ == "__main__":
     fit, save, load, export_json, export_path = config.load_settings(
         args.export_path
     )
+    posterior_format, posterior_sites = config.load_posterior_settings()
+    if args.export_only:
+        fit, load = False, True
     print("Settings loaded")
 
     # Find export path
@@ -585,12 +868,7 @@ if __name__ == "__main__":
         make_model_directories(export_path)
 
     # Find pivot
-    # Use mlr config pivot unless a dataset-specific pivot is specified
-    pivot = None
-    if config.config["model"]["pivot"]:
-        pivot = config.config["model"]["pivot"]
-    if args.pivot and args.pivot != "None":
-        pivot = args.pivot
+    pivot = config.load_pivot(args.pivot)
     print("pivot", pivot)
 
     # Load location_ga_inclusion_threshold
@@ -602,9 +880,7 @@ if __name__ == "__main__":
     print("location_ga_inclusion_threshold", location_ga_inclusion_threshold)
 
     # Find aggregation_frequency
-    aggregation_frequency = None
-    if config.config["data"]["aggregation_frequency"]:
-        aggregation_frequency = config.config["data"]["aggregation_frequency"]
+    aggregation_frequency = config.load_aggregation_frequency()
 
     # Fit or load model results
     if fit:
@@ -619,21 +895,29 @@ if __name__ == "__main__":
             save,
             pivot=pivot,
             max_date=args.max_date,
-            aggregation_frequency=aggregation_frequency
+            aggregation_frequency=aggregation_frequency,
+            posterior_format=posterior_format,
+            posterior_sites=posterior_sites,
+            timer=timer,
         )
     elif load:
         print("Loading results")
-        multi_posterior = load_models(
-            raw_seq,
-            locations,
-            mlr_model,
-            export_path,
-        )
+        with timer.stage("load_posterior"):
+            multi_posterior = load_models(
+                raw_seq,
+                locations,
+                mlr_model,
+                export_path,
+                posterior_format=posterior_format,
+                posterior_sites=posterior_sites,
+                hier=hier,
+            )
     else:
         print("No models fit or results loaded.")
         multi_posterior = ef.MultiPosterior()
 
     # Export results
+    data_name = args.data_name or config.config["data"]["name"]
     if export_json and (fit or load):
         print(f"Exporting results as .json at {export_path}")
         ps = parse_with_default(
@@ -642,8 +926,228 @@ if __name__ == "__main__":
         ps_point_estimator = parse_with_default(
             config.config["settings"], "ps_point_estimator", dflt="median"
         )
-        data_name = args.data_name or config.config["data"]["name"]
-        if config.config["model"]["version"] == "MLR":
-            export_results_mlr(multi_posterior, ps, export_path, data_name, hier, location_ga_inclusion_threshold, variant_location_counts, ps_point_estimator)
-        elif config.config["model"]["version"] == "Latent":
-            export_results_latent(multi_posterior, ps, export_path, data_name, hier)
+        with timer.stage("export"):
+            if config.config["model"]["version"] == "MLR":
+                export_results_mlr(multi_posterior, ps, export_path, data_name, hier, location_ga_inclusion_threshold, variant_location_counts, ps_point_estimator, model=mlr_model)
+            elif config.config["model"]["version"] == "Latent":
+                export_results_latent(multi_posterior, ps, export_path, data_name, hier)
+
+    # Save timings of each stage next to the results
+    if export_path:
+        timer.save(f"{export_path}/{data_name}_timings.json")
+        print(f"Stage timings saved at {export_path}/{data_name}_timings.json")
+
+
+def backtest_chunk(args, tensor, origins):
+    """
+    Fit and score forecasts of the model configured by the given arguments
+    from each of the given forecast origins in order.
+
+    Returns the metrics of each forecast and the timings of each stage.
+    """
+    config = ModelConfig(args.config)
+    model, _ = config.load_model(override_hier=True)
+    inference_method = config.load_optim()
+    timer = StageTimer()
+
+    def fit(model, data, name, init_values):
+        return fit_model(inference_method, model, data, name, timer, init_values, args.backtest_warm_start_iters)
+
+    rows = backtest.backtest_origins(
+        tensor,
+        origins,
+        model,
+        fit,
+        pivot=config.load_pivot(args.pivot),
+        aggregation_frequency=config.load_aggregation_frequency(),
+        timer=timer,
+    )
+    return rows, timer.stages
+
+
+def run_backtest(args):
+    """
+    Score forecasts of the hierarchical model for the given command line
+    arguments from each forecast origin. All origins share one data load and
+    truncate the same count tensor. Origins are split into segments of
+    consecutive origins that each start from scratch, and with more than one
+    job, worker processes run segments concurrently. Scores depend on the
+    segments but not on the number of jobs.
+    """
+    timer = StageTimer()
+    config = ModelConfig(args.config)
+    print(f"Config loaded: {config.path}")
+
+    if not (args.hier or config.config["model"].get("hierarchical", False)):
+        raise Exception("Backtesting requires a hierarchical model. Set model.hierarchical in the config or use --hier.")
+    if not config.config["model"].get("forecast_L", 0):
+        raise Exception("Backtesting requires forecasts. Set model.forecast_L in the config to the number of time points to forecast.")
+
+    with timer.stage("load_data"):
+        raw_seq, locations = config.load_data(args.seq_path)
+        if not isinstance(raw_seq, count_tensor.CountTensor):
+            raw_seq = count_tensor.CountTensor.from_seq_counts(raw_seq)
+        tensor = raw_seq.subset_locations(locations)
+    print("Data loaded sucessfuly")
+
+    origins = sorted(pd.Timestamp(origin).strftime("%Y-%m-%d") for origin in args.backtest_origins)
+    chunks = backtest.split_origins(origins, args.backtest_segment_size)
+    if args.jobs <= 1 or len(chunks) == 1:
+        results = [backtest_chunk(args, tensor, chunk) for chunk in chunks]
+    else:
+        # Use fresh worker processes as for manifests, sending each worker
+        # the loaded counts instead of loading them again.
+        initializer = enable_compilation_cache if args.compilation_cache else None
+        with ProcessPoolExecutor(
+            max_workers=min(args.jobs, len(chunks)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initializer,
+            initargs=(args.compilation_cache,) if args.compilation_cache else (),
+        ) as executor:
+            results = list(executor.map(backtest_chunk, [args] * len(chunks), [tensor] * len(chunks), chunks))
+
+    rows = []
+    for chunk_rows, chunk_stages in results:
+        rows.extend(chunk_rows)
+        timer.stages.extend(chunk_stages)
+
+    metrics = pd.DataFrame(rows, columns=backtest.METRICS_COLUMNS)
+    print("Mean forecast scores by horizon:")
+    print(metrics.groupby("horizon")[["log_score", "mae"]].mean())
+
+    # Save compact metrics instead of full results
+    _, _, _, _, export_path = config.load_settings(args.export_path)
+    if export_path:
+        make_path_if_absent(export_path)
+    data_name = args.data_name or config.config["data"]["name"]
+    output = args.backtest_output or f"{export_path}/{data_name}_backtest.tsv"
+    metrics.to_csv(output, sep="\t", index=False)
+    print(f"Forecast scores saved at {output}")
+
+    if export_path:
+        timer.save(f"{export_path}/{data_name}_backtest_timings.json")
+        print(f"Stage timings saved at {export_path}/{data_name}_backtest_timings.json")
+
+
+if __name__ == "__main__":
+    profile_from_environment(__file__)
+
+    parser = argparse.ArgumentParser(
+        description="Estimating variant growth rates."
+    )
+    parser.add_argument("--config", help="path to config file")
+    parser.add_argument(
+        "--seq-path",
+        help="File path to sequence data or count tensor bundle from prepare-data.py. Overrides data.seq_path in config.",
+    )
+    parser.add_argument(
+        "--export-path",
+        help="Path to export directory. Overrides settings.export_path in config.",
+    )
+    parser.add_argument(
+        "--data-name",
+        help="Name of the data set to include in the results filename as <data_name>_results.json. "
+        + "Overrides data.name in config.",
+    )
+    parser.add_argument(
+        "--pivot",
+        help="Variant to use as pivot. Overrides model.pivot in config.",
+    )
+
+    parser.add_argument(
+        "--hier",  action='store_true', default=False,
+        help="Whether to run the model as hierarchical. Overrides model.hierarchical in config. "
+        + "Default is false if unspecified."
+    )
+
+    parser.add_argument(
+        "--max-date",
+        help="Latest date in ISO 8601 format (YYYY-MM-DD) or backward-looking relative date in ISO 8601 duration (e.g., '14D' or 'P14D') for observed frequency estimation. Any aggregation frequency operates backward in time from this date. If this date isn't provided, the latest date from the given sequence counts data will be used.",
+    )
+
+    parser.add_argument(
+        "--location-ga-inclusion-threshold", type=nonnegative_int, default=0,
+        help="Mininum number of sequences that need to be observed for a specific "
+        + "location x variant combination. Default is 0, ie including all combinations "
+        + "even if there isn't data for a particular combination."
+    )
+
+    parser.add_argument(
+        "--export-only", action="store_true", default=False,
+        help="Load model results saved by a previous run from the export path and export them without fitting. "
+        + "Overrides settings.fit and settings.load in config."
+    )
+
+    parser.add_argument(
+        "--manifest",
+        help="Tab-delimited file with one model run per row to run in a single process, so imports and compiled "
+        + f"models are shared between runs. Columns can be any of {', '.join(MANIFEST_COLUMNS)} with 'config' required. "
+        + "Other command line arguments provide defaults for empty or missing columns.",
+    )
+
+    parser.add_argument(
+        "--jobs", type=nonnegative_int, default=1,
+        help="Number of worker processes to run models from the manifest or backtest segments (--backtest-segment-size) "
+        + "concurrently. Default is 1, running them sequentially."
+    )
+
+    parser.add_argument(
+        "--compilation-cache",
+        help="Directory for the persistent cache of compiled models to reuse them between runs and processes.",
+    )
+
+    parser.add_argument(
+        "--backtest-origins", nargs="+",
+        help="Forecast origins as ISO 8601 dates (YYYY-MM-DD) to fit the hierarchical model from with the data available "
+        + "on each date and score its forecasts against the data observed after it instead of exporting results. "
+        + "Origins run in order, each starting from the fit of the previous origin in the same segment.",
+    )
+
+    parser.add_argument(
+        "--backtest-segment-size", type=nonnegative_int,
+        help="Number of consecutive origins in each backtest segment. The first origin of each segment starts from "
+        + "scratch instead of the fit of the previous origin, and --jobs runs segments concurrently, so scores depend "
+        + "on the segment size but not on the number of jobs. Default is all origins in one segment.",
+    )
+
+    parser.add_argument(
+        "--backtest-output",
+        help="Path to TSV of forecast scores by origin, location, and horizon. "
+        + "Default is <export_path>/<data_name>_backtest.tsv.",
+    )
+
+    parser.add_argument(
+        "--backtest-warm-start-iters", type=nonnegative_int,
+        help="Number of optimization steps for MAP and FullRank fits that start from the fit of the previous origin. "
+        + "Default is inference.iters from the config.",
+    )
+
+    parser.add_argument(
+        "--threads", type=nonnegative_int,
+        help="Maximum number of threads for JAX to run models with on the CPU, so concurrent model runs share "
+        + "the machine without oversubscribing it. Applies to each worker process with --jobs. "
+        + "Default is one thread per available core.",
+    )
+
+    parser.add_argument(
+        "--device-count", type=nonnegative_int,
+        help="Number of JAX devices to split the CPU into, so NUTS chains (inference.num_chains in config) run in "
+        + "parallel instead of one after another. Default is one device.",
+    )
+
+    args = parser.parse_args()
+
+    limit_jax_resources(args.threads, args.device_count)
+
+    if args.compilation_cache:
+        enable_compilation_cache(args.compilation_cache)
+
+    if args.manifest:
+        runs = read_manifest(args.manifest, args)
+        failed = run_manifest(runs, args.jobs, args.compilation_cache)
+        if failed:
+            sys.exit(f"{failed} of {len(runs)} model runs failed.")
+    elif args.backtest_origins:
+        run_backtest(args)
+    else:
+        run_model(args)
@@ -0,0 +1,87 @@
+"""Render plot panels in a process pool and compose them into a single image.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+import re
+import sys
+
+
+def panel_filename(directory, name, extension="png"):
+    """Return a file path for the panel with the given name in the given
+    directory, replacing characters that are awkward in file names.
+
+    >>> panel_filename("plots", "Hong Kong")
+    'plots/Hong_Kong.png'
+    >>> panel_filename("plots", "Cote d'Ivoire")
+    'plots/Cote_d_Ivoire.png'
+    """
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")
+    return os.path.join(directory, f"{safe_name}.{extension}")
+
+
+def render_panels(render_function, tasks, threads=1):
+    """Call the given render function once per task where each task is a tuple
+    of positional arguments. Tasks run in a pool of processes when more than
+    one thread is requested. Returns the results in the order of the tasks.
+    """
+    if threads <= 1 or len(tasks) <= 1:
+        return [render_function(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=min(threads, len(tasks))) as executor:
+        futures = [executor.submit(render_function, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def compose_panels(panel_paths, output, columns, legend_path=None, title=None, dpi=300):
+    """Tile the given panel images into a grid with the given number of columns
+    and save the result to the given output path. Each cell of the grid has the
+    size of the largest panel. If a legend image is given, place it to the right
+    of the grid aligned with the top row. If a title is given, draw it as a
+    header centered above the grid like the title of a faceted chart. Without
+    any panels, the result only has the legend (or is blank) and a warning gets
+    printed.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    panels = [Image.open(path).convert("RGB") for path in panel_paths]
+    if not panels:
+        print(f"WARNING: No panels to compose into {output}, so it only has the legend.", file=sys.stderr)
+
+    cell_width = max((panel.width for panel in panels), default=0)
+    cell_height = max((panel.height for panel in panels), default=0)
+    columns = max(1, min(columns, len(panels)))
+    rows = math.ceil(len(panels) / columns)
+
+    legend = Image.open(legend_path).convert("RGB") if legend_path else None
+    legend_width = legend.width if legend else 0
+
+    # Size the header like a 13 point title at the given resolution
+    font, title_height = None, 0
+    if title:
+        font_size = round(13 * dpi / 72)
+        font = ImageFont.load_default(size=font_size)
+        title_height = 2 * font_size
+
+    composed = Image.new(
+        "RGB",
+        (max(1, cell_width * columns + legend_width), max(1, title_height + max(cell_height * rows, legend.height if legend else 0))),
+        "white",
+    )
+    for i, panel in enumerate(panels):
+        row, column = divmod(i, columns)
+        composed.paste(panel, (column * cell_width, title_height + row * cell_height))
+
+    if legend:
+        composed.paste(legend, (cell_width * columns, title_height))
+
+    if title:
+        ImageDraw.Draw(composed).text(
+            (max(cell_width * columns, 1) / 2, title_height / 2),
+            title,
+            fill="black",
+            font=font,
+            anchor="mm",
+        )
+
+    composed.save(output, dpi=(dpi, dpi))
@@ -0,0 +1,106 @@
+"""Record wall time, peak memory, and JAX compilation time of named stages.
+
+Stages are timed with the `StageTimer.stage` context manager and saved as a
+JSON list of records, so performance regressions can be traced to the stage
+that introduced them.
+"""
+from contextlib import contextmanager
+import json
+import resource
+import sys
+import time
+
+# JAX reports the duration of each step of compiling a function as a separate
+# monitoring event: tracing to a jaxpr, lowering to MLIR, and XLA compilation.
+JAX_COMPILE_EVENTS = (
+    "/jax/core/compile/jaxpr_trace_duration",
+    "/jax/core/compile/jaxpr_to_mlir_module_duration",
+    "/jax/core/compile/backend_compile_duration",
+)
+
+# Total seconds spent compiling JAX functions in this process so far
+_compile_time = 0.0
+_listening = False
+
+
+def _record_compile_time(event, duration, **kwargs):
+    global _compile_time
+    if event in JAX_COMPILE_EVENTS:
+        _compile_time += duration
+
+
+def _listen_for_compilation():
+    """Start accumulating JAX compilation time in this process.
+    """
+    global _listening
+    if _listening:
+        return
+
+    import jax.monitoring
+
+    jax.monitoring.register_event_duration_secs_listener(_record_compile_time)
+    _listening = True
+
+
+def maxrss_to_mb(maxrss):
+    """Convert a peak resident set size reported by `resource` to MB.
+    """
+    # Linux reports kilobytes while macOS reports bytes
+    if sys.platform == "darwin":
+        return maxrss / 1024 / 1024
+    return maxrss / 1024
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB.
+    """
+    return maxrss_to_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+class StageTimer:
+    def __init__(self):
+        """Collect timings of named stages of a run.
+
+        For each stage, records the wall time, the time spent compiling JAX
+        functions, the remaining wall time spent executing, and the peak
+        resident memory of the process at the end of the stage. Peak memory
+        never decreases, so the first stage where it increases is the stage
+        that allocated the most memory.
+        """
+        _listen_for_compilation()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Time the code run within this context as a stage with the given name.
+        Additional labels (e.g., the name of a model) are saved with the stage.
+        """
+        start_compile_time = _compile_time
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - start
+            compile_time = _compile_time - start_compile_time
+            self.stages.append({
+                "stage": name,
+                **labels,
+                "wall_time_s": round(wall_time, 4),
+                "compile_time_s": round(compile_time, 4),
+                "execute_time_s": round(max(wall_time - compile_time, 0.0), 4),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            })
+
+    def save(self, path):
+        """Save timings of all stages as JSON to the given path.
+        """
+        with open(path, "w") as fh:
+            json.dump(
+                {
+                    "stages": self.stages,
+                    "total_wall_time_s": round(sum(stage["wall_time_s"] for stage in self.stages), 4),
+                    "peak_rss_mb": round(peak_rss_mb(), 1),
+                },
+                fh,
+                indent=2,
+            )
@@ -1,29 +1,36 @@
 from collections import deque
+import datetime
 import isodate
+import numpy as np
 import pandas as pd
 
 
-def aggregate_temporally(seq_counts, dates, max_date, frequency):
+def aggregation_bins(min_date, max_date, frequency):
     """
-    Aggregates time-series data based on a specified frequency (e.g., weekly, monthly).
+    Calculate the edges of date bins to aggregate counts into.
+
+    Bin edges start from the max date (inclusive) and work backwards in time by
+    a time delta that matches the given aggregation frequency for as long as
+    they are later than the min date. The min date is always included as the
+    earliest edge, so the earliest records fall into the first bin. This
+    approach allows us to specify a fixed latest date regardless of the
+    available data. The pandas's "backward resample" approach accomplishes
+    nearly the same outcome except that approach will use the latest observed
+    date in the given data as the latest date bin.
 
     Parameters:
-        - 'seq_counts' (numpy.ndarray): A 2D array where each row corresponds to a time point and columns
-        - 'dates' (list of pandas.Timestamp): A list of timestamps corresponding to each row in 'seq_counts'.
-        - max_date (pandas.Timestamp): The latest date to use for observed frequency estimation. Aggregated dates get constructed
-          backward in time from this date using the given frequency value.
-        - frequency (str): A string representing the frequency of aggregation, according to pandas offset aliases.
-          Examples include 'W-SUN' for weekly aggregation ending on Sunday, 'M' for monthly.
+        - min_date (pandas.Timestamp): The earliest date to aggregate.
+        - max_date (pandas.Timestamp): The latest date to aggregate.
+        - frequency (str): An ISO 8601 duration with or without the leading "P" (e.g., '1W', 'P2W', '1M').
 
     Returns:
-        - 'seq_counts_agg' (numpy.ndarray): A 2D array where each row corresponds to aggreagted counts
-        - 'dates_agg' (list of pandas.Timestamp): A list of timestamps corresponding to each row in 'seq_counts'.
-        - 'date_to_index' (dict): A dictionary mapping timestamps to row in 'seq_counts_agg'
+        - 'bins' (pandas.DatetimeIndex): Sorted edges of the date bins.
 
+    >>> list(aggregation_bins(pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-20"), "1W").strftime("%Y-%m-%d"))
+    ['2024-01-01', '2024-01-06', '2024-01-13', '2024-01-20']
+    >>> list(aggregation_bins(pd.Timestamp("2024-01-01"), pd.Timestamp("2024-03-15"), "1M").strftime("%Y-%m-%d"))
+    ['2024-01-01', '2024-01-15', '2024-02-15', '2024-03-15']
     """
-    columns_seq_counts = [f"seq_{i}" for i in range(seq_counts.shape[1])]
-    df = pd.DataFrame(seq_counts, index=dates, columns=columns_seq_counts)
-
     # Default frequency is 1 day.
     # Ensure the given frequency is a standard ISO duration with a leading "P".
     if frequency is None:
@@ -31,54 +38,69 @@ def aggregate_temporally(seq_counts, dates, max_date, frequency):
     elif not frequency.startswith("P"):
         frequency = f"P{frequency}"
 
-    # Start calculating dates to estimate frequencies starting from the max date
-    # (inclusive), working backwards in time by a time delta that matches the
-    # user-requested aggregation frequency. Include the start date in the final
-    # dates when the interval spacing allows that date to be included. This
-    # approach allows us to specify a fixed latest date regardless of the
-    # available data. The pandas's "backward resample" approach accomplishes
-    # nearly the same outcome except that approach will use the latest observed
-    # date in the given data frame as the latest date bin.
     delta = isodate.parse_duration(frequency)
-    min_date = min(dates)
-    dates_to_estimate = deque([])
-    date_to_estimate = max_date
-    while date_to_estimate > min_date:
-        dates_to_estimate.appendleft(date_to_estimate)
-        date_to_estimate = max_date - delta * len(dates_to_estimate)
-
-    # Always include the earliest observed date at the left of the list of dates
-    # to estimate, so the binning with pandas cut can include that earliest
-    # record in the next date bin.
-    dates_to_estimate.appendleft(min_date)
-
-    # Aggregate each record in the data frame into one of the precalculated date
-    # bins with the latest date representing the latest record through to the
-    # next earliest date bin. This approach ensures that any given date bin
-    # represents the records collected up to that date and not after that date.
-    bins = pd.to_datetime(dates_to_estimate)
-    date_bin_labels = pd.cut(df.index, bins=bins, labels=bins[1:], include_lowest=True)
-
-    # Grouping the data according to the specified date bin labels.
-    grouped = df.groupby(date_bin_labels).sum()
-
-    seq_counts_agg = grouped[columns_seq_counts].values
-    dates_agg = list(grouped.index)
-    date_to_index = {d: i for (i, d) in enumerate(dates_agg)}
-    return seq_counts_agg, dates_agg, date_to_index
+    min_date = pd.Timestamp(min_date)
+    max_date = pd.Timestamp(max_date)
 
+    if isinstance(delta, datetime.timedelta):
+        # Count the number of fixed steps back from the max date that remain
+        # later than the min date and calculate all edges at once.
+        delta = pd.Timedelta(delta)
+        n_bins = max(0, -(-(max_date - min_date) // delta))
+        dates_to_estimate = max_date - delta * np.arange(n_bins)[::-1]
+    else:
+        # Calendar durations (months and years) vary in length, so step back
+        # one duration at a time.
+        dates_to_estimate = deque([])
+        date_to_estimate = max_date
+        while date_to_estimate > min_date:
+            dates_to_estimate.appendleft(date_to_estimate)
+            date_to_estimate = max_date - delta * len(dates_to_estimate)
 
-def aggregate_temporally_hierarchical(groups, dates, max_date, frequency):
+    return pd.DatetimeIndex([min_date]).append(pd.DatetimeIndex(dates_to_estimate))
+
+
+def aggregate_temporally(seq_counts, dates, max_date, frequency):
     """
-    Applies `aggregate_temporally` to each group within a hierarchical model.
+    Aggregates time-series data based on a specified frequency (e.g., weekly, monthly).
+
+    Parameters:
+        - 'seq_counts' (numpy.ndarray): An array where the first axis corresponds to time points. Any
+          further axes (e.g., variants and groups) are aggregated at once.
+        - 'dates' (list of pandas.Timestamp): A list of timestamps corresponding to each row in 'seq_counts'.
+        - max_date (pandas.Timestamp): The latest date to use for observed frequency estimation. Aggregated dates get constructed
+          backward in time from this date using the given frequency value.
+        - frequency (str): A string representing the frequency of aggregation as an ISO 8601 duration
+          with or without the leading "P". Examples include '1W' for weekly aggregation, '1M' for monthly.
+
+    Returns:
+        - 'seq_counts_agg' (numpy.ndarray): An array where each row corresponds to aggreagted counts
+        - 'dates_agg' (list of pandas.Timestamp): A list of timestamps corresponding to each row in 'seq_counts'.
+        - 'date_to_index' (dict): A dictionary mapping timestamps to row in 'seq_counts_agg'
+
     """
+    seq_counts = np.nan_to_num(np.asarray(seq_counts, dtype=float))
+    dates = pd.DatetimeIndex(dates)
+    bins = aggregation_bins(dates.min(), max_date, frequency)
 
-    for group in groups:
-        seq_counts, dates_agg, date_to_index = aggregate_temporally(
-            group.seq_counts, dates, max_date, frequency
-        )
-        group.seq_counts = seq_counts
-        group.dates = dates_agg
-        group.date_to_index = date_to_index
+    # Map each date to the bin that ends on or after that date, so any given
+    # date bin represents the records collected up to that date and not after
+    # that date. The earliest edge belongs to the first bin and dates after the
+    # max date do not belong to any bin.
+    n_bins = len(bins) - 1
+    bin_index = np.maximum(bins.searchsorted(dates, side="left") - 1, 0)
+    in_bins = bin_index < n_bins
 
-    return groups, dates_agg, date_to_index
+    # Sum rows of all dates in each bin at once. Bins without any dates (e.g.,
+    # after the last date) are left out.
+    order = np.argsort(bin_index[in_bins], kind="stable")
+    sorted_index = bin_index[in_bins][order]
+    starts = np.searchsorted(sorted_index, np.arange(n_bins), side="left")
+    non_empty = np.diff(np.append(starts, len(sorted_index))) > 0
+
+    seq_counts_agg = np.add.reduceat(
+        seq_counts[in_bins][order], starts[non_empty], axis=0
+    )
+    dates_agg = list(bins[1:][non_empty])
+    date_to_index = {d: i for (i, d) in enumerate(dates_agg)}
+    return seq_counts_agg, dates_agg, date_to_index